@@ -1,12 +1,16 @@
 import re
-import spacy
 import textstat
-from collections import Counter
+from collections import Counter, deque
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
 import os
 from dotenv import load_dotenv
-from groq import Groq
 import numpy as np
 import math
+import random
+import threading
+import time
+from llm_gateway import estimate_tokens
 import logging
 
 # Configure logging
@@ -16,13 +20,138 @@ load_dotenv()
 
 logger.info("Loaded Modules...")
 #nltk.download('punkt') # This has to be only run once
-nlp = spacy.load("en_core_web_sm")
-client = Groq(
-    api_key=os.environ.get("GROQ_API_KEY"),
-)
+
+# The spaCy pipeline and the Groq client are expensive to create, so they are
+# built on first use instead of at import time.
+_nlp = None
+_client = None
+_gateway = None
+_cache = None
+_nlp_lock = threading.Lock()
+_client_lock = threading.Lock()
+_gateway_lock = threading.Lock()
+_cache_lock = threading.Lock()
+
+MODEL_NAME = "meta-llama/llama-4-scout-17b-16e-instruct"
+# Bump whenever the summarization prompt changes so cached summaries are not reused
+SUMMARY_PROMPT_VERSION = 1
+
+# StyleAnalyzer only needs POS tags, dependencies and sentence boundaries
+DISABLED_PIPES = ["ner", "lemmatizer"]
+
+def get_nlp():
+    """
+    Returns the shared spaCy pipeline, loading it on first use.
+    """
+    global _nlp
+    if _nlp is None:
+        with _nlp_lock:
+            if _nlp is None:
+                import spacy
+                logger.info("Loading spaCy pipeline...")
+                _nlp = spacy.load("en_core_web_sm", disable=DISABLED_PIPES)
+    return _nlp
+
+def get_client():
+    """
+    Returns the shared Groq client, creating it on first use.
+    """
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                if os.environ.get("USE_FAKE_LLM", "false").lower() == "true":
+                    from fake_llm import FakeClient
+                    _client = FakeClient(token_delay=float(os.environ.get("FAKE_LLM_TOKEN_DELAY", "0")))
+                else:
+                    from groq import Groq
+                    _client = Groq(
+                        api_key=os.environ.get("GROQ_API_KEY"),
+                    )
+    return _client
+
+def get_gateway():
+    """
+    Returns the shared LLM gateway, which rate limits and retries the
+    non-streaming completion requests.
+    """
+    global _gateway
+    if _gateway is None:
+        with _gateway_lock:
+            if _gateway is None:
+                from llm_gateway import create_gateway
+                _gateway = create_gateway()
+    return _gateway
+
+def get_cache():
+    """
+    Returns the shared on-disk LLM response cache.
+    """
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                from llm_cache import create_cache
+                _cache = create_cache()
+    return _cache
+
+def complete(cache=None, **request):
+    """
+    Sends a chat completion request through the gateway and returns the
+    message content.
+
+    Args:
+        cache (bool): Whether to use the response cache. By default only
+                      deterministic requests (temperature 0) are cached, since
+                      sampled calls should give a fresh answer every time.
+        **request: Arguments for chat.completions.create.
+
+    Returns:
+        str: The content of the model's reply.
+    """
+    if cache is None:
+        cache = request.get("temperature", 1.0) == 0
+    if not cache:
+        return _complete_through_gateway(request)
+
+    key = get_cache().key_for(request)
+    content = get_cache().get(key)
+    if content is not None:
+        logger.info(f"LLM cache hit : {get_cache().stats()}")
+        return content
+    start = time.monotonic()
+    content = _complete_through_gateway(request)
+    get_cache().put(key, content, time.monotonic() - start)
+    return content
+
+def _complete_through_gateway(request):
+    gateway = get_gateway()
+    content = gateway.complete(**request).choices[0].message.content
+    logger.info(f"LLM gateway : {gateway.stats()}")
+    return content
+
+def warm_up():
+    """
+    Loads the spaCy pipeline and the Groq client ahead of the first request.
+    """
+    logger.info("Warming up tools...")
+    get_nlp()
+    get_client()
+    get_gateway()
 
 logger.info("Initializing Tools...")
 
+@lru_cache(maxsize=100000)
+def count_syllables(word):
+    """
+    Returns the number of syllables in a lowercase word. Words repeat a lot
+    across mail, so results are memoized.
+    """
+    return textstat.syllable_count(word)
+
+def is_contraction_suffix(text):
+    return text.lower() == "n't" or (len(text) > 1 and text[0] == "'" and text[1:].isalpha())
+
 class StyleAnalyzer:
     def __init__(self, use_weights=True):
         self.use_weights = use_weights
@@ -53,44 +182,205 @@ class StyleAnalyzer:
             1.2, 1.0, 1.0, 1.0   # style markers
         ]) if self.use_weights else np.ones(21)
     
-    def extract(self, text):
-        doc = nlp(text)
-        sentences = list(doc.sents)
-        words = [token.text for token in doc if token.is_alpha]
-        word_count = len(words)
-        pos_counts = Counter([token.pos_ for token in doc])
+    def extract_counts(self, text):
+        """
+        Extracts the additive counts that all style features are derived from.
+        Counts from several texts can be combined with merge_counts, so a
+        profile can be updated one message at a time.
+
+        Args:
+            text (str): Text to analyze.
+
+        Returns:
+            dict: Raw counts, plus the vocabulary of distinct words used.
+        """
+        return self.counts_from_doc(get_nlp()(text), text)
+
+    def counts_from_doc(self, doc, text):
+        """
+        Computes the counts for extract_counts from an already parsed doc,
+        walking its tokens only once.
+        """
+        words = []
+        characters = connectives = clauses = passives = informal_words = 0
+        syllables = polysyllables = contractions = emojis = 0
+        pos_counts = Counter()
+        previous = None
+        for token in doc:
+            pos_counts[token.pos_] += 1
+            if token.lower_ in self.connectives:
+                connectives += 1
+            if token.dep_ in ("ccomp", "advcl", "relcl"):
+                clauses += 1
+            elif token.dep_ == "auxpass":
+                passives += 1
+            if token.is_alpha:
+                words.append(token.text)
+                characters += len(token.text)
+                if token.lower_ in self.informal_words:
+                    informal_words += 1
+                word_syllables = count_syllables(token.lower_)
+                syllables += word_syllables
+                if word_syllables >= 3:
+                    polysyllables += 1
+            else:
+                # spaCy splits "don't" into "do" + "n't" and "it's" into "it" + "'s"
+                if is_contraction_suffix(token.text) and previous is not None and not previous.whitespace_ and previous.text[-1:].isalnum():
+                    contractions += 1
+                emojis += sum(1 for ch in token.text if not (ch.isalnum() or ch == "_" or ch.isspace() or ch in ",.!?;:"))
+            previous = token
 
         return {
-            'connective_density': sum(w.lower_ in self.connectives for w in doc) / max(1, word_count),
-            'pronoun_density': sum(t.pos_ == "PRON" for t in doc) / max(1, word_count),
-            'lexical_overlap': len(set(w.lower() for w in words if len(w) > 3)) / max(1, len(words)),
+            'words': len(words),
+            'sentences': sum(1 for _ in doc.sents),
+            'characters': characters,
+            'syllables': syllables,
+            'polysyllables': polysyllables,
+            'connectives': connectives,
+            'pronouns': pos_counts["PRON"],
+            'clauses': clauses,
+            'passives': passives,
+            'informal_words': informal_words,
+            'nouns': pos_counts["NOUN"],
+            'verbs': pos_counts["VERB"],
+            'adjectives': pos_counts["ADJ"],
+            'adverbs': pos_counts["ADV"],
+            'contractions': contractions,
+            'exclamations': text.count("!"),
+            'questions': text.count("?"),
+            'emojis': emojis,
+            'vocabulary': sorted(set(words)),
+        }
 
-            'avg_sentence_length': word_count / max(1, len(sentences)),
-            'clause_density': sum(1 for token in doc if token.dep_ in ["ccomp", "advcl", "relcl"]) / max(1, len(sentences)),
-            'passive_voice_ratio': sum(1 for token in doc if token.dep_ == "auxpass") / max(1, len(sentences)),
+    @staticmethod
+    def merge_counts(total, counts, merge_vocabulary=True):
+        """
+        Adds counts into total and returns the combined counts.
 
-            'avg_word_length': sum(len(w) for w in words) / max(1, word_count),
-            'avg_syllables_per_word': textstat.syllable_count(text) / max(1, word_count),
-            'type_token_ratio': len(set(words)) / max(1, word_count),
+        Args:
+            merge_vocabulary (bool): Whether to merge the vocabularies too.
+                                     When folding many texts, pass False and
+                                     collect the vocabulary in a set instead
+                                     of re-sorting it for every text.
+        """
+        merged = {key: total.get(key, 0) + value for key, value in counts.items() if key != 'vocabulary'}
+        if merge_vocabulary:
+            merged['vocabulary'] = sorted(set(total.get('vocabulary', [])) | set(counts['vocabulary']))
+        return merged
 
-            'informal_word_density': sum(w.lower() in self.informal_words for w in words) / max(1, word_count),
+    def features_from_counts(self, counts):
+        """
+        Derives the style features from counts produced by extract_counts or
+        merge_counts. Readability scores use the standard Flesch-Kincaid, SMOG
+        and Gunning-Fog formulas over the aggregated counts.
+        """
+        word_count = max(1, counts['words'])
+        sentence_count = max(1, counts['sentences'])
+        vocabulary = counts['vocabulary']
 
-            'flesch_kincaid': textstat.flesch_kincaid_grade(text),
-            'smog': textstat.smog_index(text),
-            'gunning_fog': textstat.gunning_fog(text),
+        words_per_sentence = counts['words'] / sentence_count
+        syllables_per_word = counts['syllables'] / word_count
+        polysyllables_per_word = counts['polysyllables'] / word_count
 
-            'noun_ratio': pos_counts["NOUN"] / max(1, word_count),
-            'verb_ratio': pos_counts["VERB"] / max(1, word_count),
-            'adj_ratio': pos_counts["ADJ"] / max(1, word_count),
-            'adv_ratio': pos_counts["ADV"] / max(1, word_count),
+        return {
+            'connective_density': counts['connectives'] / word_count,
+            'pronoun_density': counts['pronouns'] / word_count,
+            'lexical_overlap': len(set(w.lower() for w in vocabulary if len(w) > 3)) / word_count,
 
-            'contraction_density': len(re.findall(r"\b\w+'\w+", text)) / max(1, word_count),
-            'exclamation_density': text.count("!") / max(1, len(sentences)),
-            'question_density': text.count("?") / max(1, len(sentences)),
-            'emoji_density': len(re.findall(r"[^\w\s,.!?;:]", text)) / max(1, word_count),
+            'avg_sentence_length': words_per_sentence,
+            'clause_density': counts['clauses'] / sentence_count,
+            'passive_voice_ratio': counts['passives'] / sentence_count,
+
+            'avg_word_length': counts['characters'] / word_count,
+            'avg_syllables_per_word': syllables_per_word,
+            'type_token_ratio': len(vocabulary) / word_count,
+
+            'informal_word_density': counts['informal_words'] / word_count,
+
+            'flesch_kincaid': 0.39 * words_per_sentence + 11.8 * syllables_per_word - 15.59,
+            'smog': 1.043 * math.sqrt(counts['polysyllables'] * 30 / sentence_count) + 3.1291,
+            'gunning_fog': 0.4 * (words_per_sentence + 100 * polysyllables_per_word),
+
+            'noun_ratio': counts['nouns'] / word_count,
+            'verb_ratio': counts['verbs'] / word_count,
+            'adj_ratio': counts['adjectives'] / word_count,
+            'adv_ratio': counts['adverbs'] / word_count,
+
+            'contraction_density': counts['contractions'] / word_count,
+            'exclamation_density': counts['exclamations'] / sentence_count,
+            'question_density': counts['questions'] / sentence_count,
+            'emoji_density': counts['emojis'] / word_count,
         }
 
-    
+    def extract(self, text):
+        return self.features_from_counts(self.extract_counts(text))
+
+    def extract_vector(self, text):
+        """
+        Returns the style features of a text as a vector, see to_vector.
+        """
+        return self.to_vector(self.extract(text))
+
+    def to_vector(self, features):
+        """
+        Returns the features as a float32 vector in feature_names order.
+        """
+        return np.array([features[name] for name in self.feature_names], dtype=np.float32)
+
+    def from_vector(self, vector):
+        """
+        Turns a vector from to_vector back into a features dictionary.
+        """
+        return {name: float(value) for name, value in zip(self.feature_names, vector)}
+
+    def summarize_style(self, features):
+        """
+        Condenses the features into a one-line style summary for prompts. It
+        carries the traits a reply can imitate in a few dozen tokens, instead
+        of the full describe_text_features text.
+        """
+        informal = features['informal_word_density'] >= 0.02 or features['contraction_density'] >= 0.05
+        return "; ".join([
+            "informal" if informal else "formal",
+            f"~{features['avg_sentence_length']:.0f} words per sentence",
+            f"reading grade {features['flesch_kincaid']:.0f}",
+            f"{self.get_qualitative_level(features['type_token_ratio'])} vocabulary variety",
+            f"{self.get_qualitative_level(features['contraction_density'])} contractions",
+            f"{self.get_qualitative_level(features['passive_voice_ratio'])} passive voice",
+            f"{self.get_qualitative_level(features['exclamation_density'])} exclamations",
+            f"{self.get_qualitative_level(features['question_density'])} questions",
+            f"{self.get_qualitative_level(features['emoji_density'])} emoji",
+        ])
+
+    def extract_many(self, texts, batch_size=64, n_process=1):
+        """
+        Extracts the style features of many texts, streaming them through
+        spaCy in batches.
+
+        Args:
+            texts (list): Texts to analyze.
+            batch_size (int): Number of texts spaCy processes per batch.
+            n_process (int): Number of processes spaCy uses for parsing.
+
+        Returns:
+            np.ndarray: Matrix of shape (len(texts), len(feature_names)).
+        """
+        texts = list(texts)
+        features = np.zeros((len(texts), len(self.feature_names)))
+        for row, counts in enumerate(self.iter_counts(texts, batch_size, n_process)):
+            values = self.features_from_counts(counts)
+            features[row] = [values[name] for name in self.feature_names]
+        return features
+
+    def iter_counts(self, texts, batch_size=64, n_process=1):
+        """
+        Yields extract_counts results for each text, parsing them with nlp.pipe.
+        """
+        # Texts are streamed, so each one is passed along as context to its doc
+        docs = get_nlp().pipe(((text, text) for text in texts), as_tuples=True, batch_size=batch_size, n_process=n_process)
+        for doc, text in docs:
+            yield self.counts_from_doc(doc, text)
+
     def get_qualitative_level(self, value, type="ratio"):
         """
         Provides a simplified qualitative description based on a numerical value.
@@ -302,6 +592,109 @@ def get_style(text1: str) -> str:
     f1 = analyzer.extract(text1)
     return analyzer.describe_text_features(f1)
 
+def pack_style_vector(vector):
+    """
+    Packs a style vector into little-endian float32 bytes for the database.
+    """
+    return np.asarray(vector, dtype='<f4').tobytes()
+
+def unpack_style_vector(data):
+    """
+    Reads a style vector packed by pack_style_vector.
+    """
+    return np.frombuffer(data, dtype='<f4')
+
+def describe_style_vector(data):
+    """
+    Generates the verbose style description from a packed style vector. It
+    is only built when someone asks for it, never stored or sent to the model.
+    """
+    return analyzer.describe_text_features(analyzer.from_vector(unpack_style_vector(data)))
+
+# Sent messages kept as style exemplars are cut to this many characters,
+# and messages shorter than EXEMPLAR_MIN_WORDS are too short to show a style
+EXEMPLAR_MAX_CHARS = 1500
+EXEMPLAR_MIN_WORDS = 20
+# Characters of each exemplar included in a reply prompt
+EXEMPLAR_PROMPT_CHARS = 600
+# Exemplars collected per analysis, sampled uniformly from the eligible
+# messages so a first analysis of a large mailbox stays bounded in memory
+EXEMPLAR_SAMPLE_SIZE = 500
+
+def update_style_profile(profile, messages, include_seen=False):
+    """
+    Folds messages that are not yet part of a style profile into it.
+
+    Args:
+        profile (dict): Profile stored on the user, or None for a new profile.
+        messages (iterable): Messages as yielded by get_messages.iter_messages.
+        include_seen (bool): Also parse messages already in the profile, only
+                             to collect their exemplars. Profiles built before
+                             exemplars were stored have none for those messages.
+
+    Returns:
+        tuple: The updated profile, its style features (None if the profile
+               has no messages yet), and a uniform sample of at most
+               EXEMPLAR_SAMPLE_SIZE new messages usable as style exemplars,
+               as {'id', 'body', 'vector'} dictionaries.
+    """
+    profile = dict(profile) if profile else {'message_ids': [], 'counts': None}
+    seen = set(profile['message_ids'])
+    # Whether every message in the profile has had its exemplar collected
+    covered = profile.get('exemplars', not seen) or include_seen
+    new_ids = []
+    # Messages spaCy has buffered but not yet returned counts for
+    pending = deque()
+    exemplars = []
+    eligible = 0
+    # Seeded so the same mailbox always yields the same sample
+    rng = random.Random(0)
+
+    def new_bodies():
+        # Messages may be a lazy stream, so they are filtered as they arrive
+        for message in messages:
+            is_new = message['id'] not in seen
+            if is_new:
+                new_ids.append(message['id'])
+            if is_new or include_seen:
+                pending.append((message, is_new))
+                yield message['body']
+
+    counts = profile['counts']
+    # Sorted once at the end, so folding N messages stays linear
+    vocabulary = set(counts['vocabulary']) if counts else set()
+    for message_counts in analyzer.iter_counts(new_bodies()):
+        message, is_new = pending.popleft()
+        if is_new:
+            vocabulary.update(message_counts['vocabulary'])
+            counts = message_counts if counts is None else analyzer.merge_counts(counts, message_counts, merge_vocabulary=False)
+        if message_counts['words'] < EXEMPLAR_MIN_WORDS:
+            continue
+        # Reservoir sampling: the n-th eligible message is kept with probability SAMPLE_SIZE / n
+        eligible += 1
+        slot = eligible - 1 if eligible <= EXEMPLAR_SAMPLE_SIZE else rng.randrange(eligible)
+        if slot >= EXEMPLAR_SAMPLE_SIZE:
+            continue
+        exemplar = {
+            'id': message['id'],
+            'body': message['body'][:EXEMPLAR_MAX_CHARS],
+            'vector': analyzer.to_vector(analyzer.features_from_counts(message_counts)).tolist(),
+        }
+        if slot < len(exemplars):
+            exemplars[slot] = exemplar
+        else:
+            exemplars.append(exemplar)
+    logger.info(f"Added {len(new_ids)} new messages to the style profile")
+
+    if counts is not None:
+        counts['vocabulary'] = sorted(vocabulary)
+    profile['counts'] = counts
+    profile['message_ids'] = profile['message_ids'] + new_ids
+    profile['exemplars'] = covered
+    if counts is None:
+        return profile, None, exemplars
+    return profile, analyzer.features_from_counts(counts), exemplars
+
 def extract_questions_from_text(text: str) -> dict:
     """
     Extracts numbered questions from a model response like:
@@ -311,16 +704,13 @@ def extract_questions_from_text(text: str) -> dict:
     question_pattern = re.findall(r"\{(\d+):\s*(.*?)\}", text)
     return {qid: question.strip() for qid, question in question_pattern}
 
-def generate_email_reply(thread_summary: str, style_hint: str, additional_info:str) -> str:
+def build_reply_messages(thread_summary: str, style_hint: str, additional_info:str, exemplars=None) -> list:
     """
-    Use this function to generate an email reply based on a thread summary, relevant messages, and a style hint.
+    Builds the chat messages used to generate an email reply.
 
     Args:
-        thread_summary (str): A summary of the email thread. You may add parts from the relevant messages if you like.
-        style_hint (str): A hint describing the desired style for the email reply
-
-    Returns:
-        str: The generated email reply.
+        exemplars (list): Optional past emails by the user, included as
+                          few-shot examples of their style.
     """
     system_prompt = """
 You are an AI email assistant. Your task is to write an email reply using:
@@ -349,17 +739,66 @@ The user's writing style is already provided.
     Write the reply to the given thread:
     """
 
-    chat_completion = client.chat.completions.create(
-        model="meta-llama/llama-4-scout-17b-16e-instruct",
-        messages=[
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": user_prompt}
-        ],
+    if exemplars:
+        examples = "\n---\n".join(exemplar[:EXEMPLAR_PROMPT_CHARS] for exemplar in exemplars)
+        user_prompt += f"""
+    Emails the user wrote before (match their tone and phrasing, not their content):
+    ---
+    {examples}
+    ---
+    """
+
+    return [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": user_prompt}
+    ]
+
+def generate_email_reply(thread_summary: str, style_hint: str, additional_info:str, exemplars=None) -> str:
+    """
+    Use this function to generate an email reply based on a thread summary, relevant messages, and a style hint.
+
+    Args:
+        thread_summary (str): A summary of the email thread. You may add parts from the relevant messages if you like.
+        style_hint (str): A hint describing the desired style for the email reply
+        exemplars (list): Optional past emails by the user to imitate.
+
+    Returns:
+        str: The generated email reply.
+    """
+    content = complete(
+        model=MODEL_NAME,
+        messages=build_reply_messages(thread_summary, style_hint, additional_info, exemplars),
         temperature=0.7,
         max_tokens=300
     )
 
-    return chat_completion.choices[0].message.content
+    return content
+
+def stream_email_reply(thread_summary: str, style_hint: str, additional_info:str, exemplars=None):
+    """
+    Streaming version of generate_email_reply. Yields pieces of the reply as
+    the model produces them.
+
+    Args:
+        thread_summary (str): A summary of the email thread.
+        style_hint (str): A hint describing the desired style for the email reply
+        exemplars (list): Optional past emails by the user to imitate.
+
+    Yields:
+        str: The next piece of the generated email reply.
+    """
+    stream = get_client().chat.completions.create(
+        model=MODEL_NAME,
+        messages=build_reply_messages(thread_summary, style_hint, additional_info, exemplars),
+        temperature=0.7,
+        max_tokens=300,
+        stream=True
+    )
+
+    for chunk in stream:
+        content = chunk.choices[0].delta.content
+        if content:
+            yield content
 
 def check_missing_info(thread_summary: str, recipient:str, additional_info:str) -> dict:
     """
@@ -401,8 +840,8 @@ Answers to previous questions:
 """
     #print("User prompt :", precheck_prompt, "\n\n")
 
-    chat_completion = client.chat.completions.create (
-        model= "meta-llama/llama-4-scout-17b-16e-instruct",
+    content = complete(
+        model= MODEL_NAME,
         messages = [
             {"role": "system", "content": system_prompt},
             {"role": "user", "content": precheck_prompt}
@@ -411,7 +850,7 @@ Answers to previous questions:
         max_tokens=300
     )
 
-    response = chat_completion.choices[0].message.content.strip()
+    response = content.strip()
     
     #print("Response :", response)
     # Use your regex extractor from earlier
@@ -427,11 +866,93 @@ def get_answers(questions:dict):
         answers[question] = input(question)
     return answers
 
+SUMMARY_SYSTEM_PROMPT = """Summarize the following email thread into 3-5 bullet points, capturing:
+                - Main discussion points
+                - Relevant and important information to keep in mind
+                - Any open questions or pending actions
+                - The tone of the conversation (formal/informal)
+
+                Your output should be in the following manner:
+                **Summary:**
+                <Summary of the provided thread>
+                """
+
+CHUNK_SYSTEM_PROMPT = """Summarize this part of a longer email thread in concise bullet points.
+                Keep names, dates, figures, decisions, open questions, pending actions
+                and the tone of the conversation. Do not add an introduction."""
+
+# Prompt tokens allowed per summarization call, estimated locally. Threads
+# over the budget are summarized in chunks, then the partial summaries are reduced.
+SUMMARY_TOKEN_BUDGET = int(os.environ.get("SUMMARY_TOKEN_BUDGET", "6000"))
+# Reduce rounds before the remaining text is truncated to the budget
+MAX_REDUCE_DEPTH = 3
+
+def build_prompt(system_prompt, user_content, budget):
+    """
+    Assembles a system/user prompt and checks it against a token budget.
+
+    Args:
+        system_prompt (str): The system message.
+        user_content (str): The user message.
+        budget (int): Maximum prompt tokens, as counted by llm_gateway.estimate_tokens.
+
+    Returns:
+        list: The chat messages.
+
+    Raises:
+        ValueError: If the prompt is over the budget.
+    """
+    messages = [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": user_content},
+    ]
+    tokens = estimate_tokens(messages)
+    if tokens > budget:
+        raise ValueError(f"Prompt of ~{tokens} tokens is over the budget of {budget}")
+    return messages
+
+def split_to_budget(text, max_tokens):
+    """
+    Splits text into consecutive chunks of at most max_tokens estimated
+    tokens, breaking between paragraphs where possible.
+    """
+    # Same four characters per token as llm_gateway.estimate_tokens
+    max_chars = max(1, max_tokens * 4)
+    chunks = []
+    current = []
+    length = 0
+    for paragraph in text.split("\n\n"):
+        # Paragraphs longer than a whole chunk are cut hard
+        pieces = [paragraph[i:i + max_chars] for i in range(0, len(paragraph), max_chars)] or [""]
+        for piece in pieces:
+            if current and length + len(piece) + 2 > max_chars:
+                chunks.append("\n\n".join(current))
+                current = []
+                length = 0
+            current.append(piece)
+            length += len(piece) + 2
+    if current:
+        chunks.append("\n\n".join(current))
+    return [chunk for chunk in chunks if chunk.strip()]
+
+def summarize_chunk(chunk):
+    """
+    Summarizes one part of a thread that is too long for a single call.
+    """
+    return complete(
+        messages=build_prompt(CHUNK_SYSTEM_PROMPT, f"Email Thread Part: {chunk}", SUMMARY_TOKEN_BUDGET),
+        model=MODEL_NAME,
+    )
+
 def summarize_threads(full_thread_text:str) -> str :
 
     """
     Use this function to summarize a given thread of mails.
 
+    Threads over SUMMARY_TOKEN_BUDGET are summarized hierarchically: chunks
+    are summarized in parallel through the gateway, then the partial
+    summaries are summarized again, so no call exceeds the budget.
+
     Args:
         full_thread_text (str): The thread of mails to summarize.
 
@@ -439,31 +960,30 @@ def summarize_threads(full_thread_text:str) -> str :
         str: Summarized text.
 
     """
-    chat_completion = client.chat.completions.create(
-        messages=[
-            {
-                "role": "system",
-                "content": 
-                """Summarize the following email thread into 3-5 bullet points, capturing:
-                - Main discussion points
-                - Relevant and important information to keep in mind
-                - Any open questions or pending actions
-                - The tone of the conversation (formal/informal)
-
-                Your output should be in the following manner:
-                **Summary:**
-                <Summary of the provided thread>
-                """
-            },
-            {
-                "role": "user",
-                "content" : f"Email Thread: {full_thread_text}"
-            }
-        ],
-        model="meta-llama/llama-4-scout-17b-16e-instruct",
+    prefix = "Email Thread: "
+    text = full_thread_text
+    for depth in range(MAX_REDUCE_DEPTH + 1):
+        # Estimated over the whole prompt, exactly as build_prompt checks it
+        if estimate_tokens([{"content": SUMMARY_SYSTEM_PROMPT + prefix + text}]) <= SUMMARY_TOKEN_BUDGET:
+            break
+        if depth == MAX_REDUCE_DEPTH:
+            logger.warning(f"Thread still over the token budget after {depth} reduce rounds, truncating")
+            text = text[:SUMMARY_TOKEN_BUDGET * 4 - len(SUMMARY_SYSTEM_PROMPT + prefix)]
+            break
+        chunk_budget = SUMMARY_TOKEN_BUDGET - estimate_tokens([{"content": CHUNK_SYSTEM_PROMPT + "Email Thread Part: "}])
+        chunks = split_to_budget(text, chunk_budget)
+        logger.info(f"Summarizing ~{estimate_tokens([{'content': text}])} tokens in {len(chunks)} chunks")
+        # The gateway bounds how many of these actually run at once
+        with ThreadPoolExecutor(max_workers=min(len(chunks), get_gateway().max_concurrency)) as pool:
+            partials = list(pool.map(summarize_chunk, chunks))
+        text = "\n\n".join(partials)
+
+    content = complete(
+        messages=build_prompt(SUMMARY_SYSTEM_PROMPT, f"{prefix}{text}", SUMMARY_TOKEN_BUDGET),
+        model=MODEL_NAME,
     )
 
-    return chat_completion.choices[0].message.content
+    return content
 
 def run_email_assistant(thread_summary: str, style_hint: str, recipient: str, additional_info = "") -> str:
     """
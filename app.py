@@ -1,4 +1,4 @@
-from flask import Flask, render_template, redirect, url_for, jsonify
+from flask import Flask, render_template, redirect, url_for, jsonify, Response, stream_with_context
 from flask import request, session
 from flask_sqlalchemy import SQLAlchemy
 from google.oauth2.credentials import Credentials
@@ -7,11 +7,19 @@ from models import User
 import re
 import authenticate
 import get_messages
+import service_cache
+import summary_cache
+import jobs
+import tasks
+import mail_index
+import mail_store
+import session_store
+import style_index
 import json
 import os
 import agent
 from dotenv import load_dotenv
-import bcrypt
+import passwords
 import logging
 
 # Configure logging
@@ -33,6 +41,9 @@ with open("app_secret_key.json", "r") as f:
 app = Flask(__name__)
 app.secret_key = secret_key
 init_app(app)
+session_store.init_app(app)
+mail_index.init_app(app)
+job_queue = jobs.init_app(app)
 
 @app.route("/")
 def index():
@@ -47,34 +58,66 @@ def validate_user():
     if request.method == "POST":
         email = request.form.get("email")
         password = request.form.get("password")
-        hashed = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt())
         user = db.session.execute(db.select(User).where(User.email == email))
         current_user = user.scalar()
-        if(current_user is None or not bcrypt.checkpw(password.encode('utf-8'), current_user.password.encode("utf-8"))):
+        # Unknown accounts are checked against a dummy hash, so they take as long as wrong passwords
+        valid, new_hash = passwords.verify_password(password, current_user.password if current_user is not None else None)
+        if not valid:
             logger.warning("Invalid credentials")
             return render_template("login.html", session=True, message="Invalid credentials!")
         logger.info("Valid credentials")
+        if new_hash is not None:
+            logger.info("Rehashing password with the current work factor")
+            current_user.password = new_hash
+            db.session.commit()
+        app.session_interface.regenerate(session)
         session["email"] = email
         session["name"] =  current_user.name
         session["logged_in"] = True
         session["user_id"] = current_user.id
         return redirect(url_for('home'))
 
+def queue_style_analysis(email, user_id, profile, credentials, kind="style", backfill_exemplars=False):
+    """
+    Queues a style analysis job that saves the updated profile, style vector
+    and exemplars when it finishes.
+
+    Raises:
+        JobLimitExceeded: If the user has too many jobs of this kind running.
+    """
+    def save_style(result):
+        user = db.session.get(User, user_id)
+        user.styleProfile = result["profile"]
+        if result["style_vector"] is not None:
+            user.styleVector = agent.pack_style_vector(result["style_vector"])
+            user.styleSummary = result["style_summary"]
+        db.session.commit()
+        style_index.store_exemplars(user_id, result["exemplars"])
+        return {"status": 200}
+
+    return job_queue.submit(email, kind, tasks.analyze_style, credentials.to_json(), profile, None, backfill_exemplars, on_done=save_style)
+
 @app.route("/get_style")
 def get_writingStyle():
-    credentials = Credentials.from_authorized_user_info(json.loads(authenticate.get_credentials(session["email"])))
-    messages = get_messages.get_full_messages(credentials, ["SENT"])
-    final_thread = ""
-    for message in messages:
-        final_thread += message["body"]
-    logger.info(f"Final Thread : {final_thread}")
-    logger.info("Fetching Users Writing style ...")
-    writing_style = agent.get_style(final_thread)
-    logger.info(f"Writing Style : {' '.join(writing_style)}")
+    credentials = authenticate.get_credentials(session["email"])
+    if credentials is None:
+        return jsonify({"error": "Gmail access not authorized"}), 401
     current_user = db.session.execute(db.select(User).where(User.email == session["email"])).scalar()
-    current_user.writingStyle = "\n".join(writing_style)
-    db.session.commit()
-    return jsonify({"status": 200})
+
+    logger.info("Fetching Users Writing style ...")
+    try:
+        job_id = queue_style_analysis(session["email"], current_user.id, current_user.styleProfile, credentials)
+    except jobs.JobLimitExceeded as error:
+        logger.warning(str(error))
+        return jsonify({"error": "Too many jobs running"}), 429
+    return jsonify({"job_id": job_id}), 202
+
+@app.route("/jobs/<job_id>")
+def job_status(job_id):
+    job = job_queue.get(job_id, session.get("email"))
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify({"id": job.id, "kind": job.kind, "status": job.status, "result": job.result, "error": job.error})
 
 @app.route("/addUser", methods=["POST"])
 def addUser():
@@ -82,52 +125,114 @@ def addUser():
         name = request.form.get("name")
         email = request.form.get("email")
         password = request.form.get("password")
-        hashed = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt())
-        logger.info(f"Hashed : {hashed}, Password:{password}")
         existing_user = db.session.execute(db.select(User).where(User.email == email))
         if len(existing_user.all()) != 0:
             return render_template("login.html", session=False, message="User already exists!")
         else:
-            new_user = User(name=name, email=email, password=hashed.decode('utf-8'), credentials = "NOT SET", writingStyle = "NOT SET")
+            new_user = User(name=name, email=email, password=passwords.hash_password(password), credentials = "NOT SET")
             db.session.add(new_user)
             db.session.commit()
         return render_template("login.html",session = True, message="User added successfully!")  
 
+def queue_backfill(email):
+    """
+    Queues indexing of the next batch of older mail. Each batch queues the
+    next one when it finishes, until the index covers the whole mailbox.
+    """
+    if mail_index.is_complete(email) or job_queue.has_active(email, "backfill"):
+        return
+    before, skip_ids = mail_index.get_backfill_point(email)
+    credentials = authenticate.get_credentials(email)
+    if before is None or credentials is None:
+        return
+
+    def save_backfill(backfill):
+        mail_index.apply_backfill(email, backfill)
+        return {"indexed": len(backfill["messages"]), "complete": backfill["complete"]}
+
+    try:
+        job_queue.submit(email, "backfill", tasks.backfill_mailbox, credentials.to_json(), before, skip_ids, on_done=save_backfill, then=lambda result: queue_backfill(email))
+    except jobs.JobLimitExceeded as error:
+        logger.warning(str(error))
+
 @app.route("/search", methods=["GET"])
 def search_mails():
     if request.method == "GET":
         logger.info("Searching emails...")
-        query = f"subject:{request.args.get('subject')}"
-        credentials = Credentials.from_authorized_user_info(json.loads(authenticate.get_credentials(session["email"])))
+        email = session["email"]
+        subject = request.args.get('subject', '')
+        stale = mail_index.is_stale(email)
+        if not stale and mail_index.is_complete(email):
+            page = request.args.get('page', 1, type=int)
+            return jsonify({"results": mail_index.search(email, subject, page), "page": page})
+
+        credentials = authenticate.get_credentials(email)
         if not credentials:
             logger.warning("No valid credentials found in session, redirecting to authorization...")
             return redirect(url_for('authorization'))
-        logger.info(f"Getting messages with query: {query}")
+        if stale:
+            if not job_queue.has_active(email, "index"):
+                try:
+                    job_queue.submit(
+                        email, "index", tasks.sync_mailbox, credentials.to_json(), mail_index.get_history_id(email),
+                        on_done=lambda sync: mail_index.apply_sync(email, sync), then=lambda result: queue_backfill(email)
+                    )
+                except jobs.JobLimitExceeded as error:
+                    logger.warning(str(error))
+        else:
+            queue_backfill(email)
+        # Until the index covers the whole mailbox, older mail is only found by Gmail
+        query = f"subject:{subject}"
+        logger.info(f"Index is stale or incomplete, getting messages with query: {query}")
         messages = get_messages.get_messages(credentials, query,)
+        logger.info(f"Gmail service cache : {service_cache.services.stats()}")
         return jsonify({"results": messages})
 
 @app.route("/search_window")
 def search_window():
     current_user = db.session.execute(db.select(User).where(User.email == session["email"])).scalar()
-    if current_user.writingStyle == "NOT SET":
+    if current_user.styleVector is None:
         return redirect(url_for("writingStyle"))
-    session['style_hint'] = current_user.writingStyle
+    session['style_hint'] = current_user.styleSummary
+    # Profiles built before exemplars were stored get them in the background
+    covered = db.session.execute(db.select(User.styleProfile["exemplars"].as_boolean()).where(User.id == current_user.id)).scalar()
+    if not covered and not job_queue.has_active(session["email"], "exemplars"):
+        credentials = authenticate.get_credentials(session["email"])
+        if credentials is not None:
+            try:
+                queue_style_analysis(session["email"], current_user.id, current_user.styleProfile, credentials, kind="exemplars", backfill_exemplars=True)
+            except jobs.JobLimitExceeded as error:
+                logger.warning(str(error))
     return render_template("search.html", username = session['name'], mailID = session['email'])
 
 @app.route("/style")
 def writingStyle():
     return render_template("writing_style.html")
 
+@app.route("/style_description")
+def style_description():
+    current_user = db.session.execute(db.select(User).where(User.email == session["email"])).scalar()
+    if current_user.styleVector is None:
+        return jsonify({"error": "Writing style not analyzed yet"}), 404
+    return jsonify({"summary": current_user.styleSummary, "writing_style": agent.describe_style_vector(current_user.styleVector)})
+
 @app.route("/get_thread/<threadID>", methods=["GET"])
 def get_thread(threadID):
     logger.info(f"Getting thread with thread ID : {threadID}")
-    credentials = Credentials.from_authorized_user_info(json.loads(authenticate.get_credentials(session["email"])))
+    credentials = authenticate.get_credentials(session["email"])
     if not credentials:
         logger.warning("No valid credentials found in session, redirecting to authorization...")
         return redirect(url_for('authorization'))
-    mails = get_messages.get_thread(credentials, threadID)
     current_user = db.session.execute(db.select(User).where(User.email == session["email"])).scalar()
-    current_user.mails = mails
+    # Only download the thread if it has messages that are not stored yet
+    message_ids = get_messages.get_thread_message_ids(credentials, threadID)
+    if message_ids is None or set(message_ids) - mail_store.stored_ids(current_user.id, message_ids):
+        mails = get_messages.get_thread(credentials, threadID)
+        mail_store.save_messages(current_user.id, mails or [])
+    else:
+        logger.info("Thread loaded from local storage")
+    logger.info(f"Gmail service cache : {service_cache.services.stats()}")
+    current_user.currentThread = threadID
     db.session.commit()
     return redirect(url_for("generate"))
 
@@ -157,9 +262,8 @@ def question(reply):
                     session['questions'].append(question)
                 session.modified = True
             else:
-                reply = agent.generate_email_reply(session['summary'], session["style_hint"], session["additional_info"])
-                logger.info("*************\nReply generated :\n"+re.sub(r'^FINAL ANSWER:\s*', '', reply))
-                return jsonify({'reply': re.sub(r"^FINAL ANSWER:\s*", "", reply), 'question': "Reply generated..."})
+                logger.info("Ready to stream the final reply")
+                return jsonify({'stream': True, 'question': "Reply generated..."})
         next_question = session['questions'][0] 
     else:
         logger.error("Error")
@@ -168,40 +272,128 @@ def question(reply):
     return jsonify({'question':next_question})
 
 
-def convert_summary_to_html(summary_text):
-    lines = summary_text.strip().split('\n')
-    list_items = [re.sub(r'^\*\s*', '', line) for line in lines if line.strip().startswith("*")]
-    html = "<ul>\n" + "\n".join([f"<li>{item}</li>" for item in list_items]) + "\n</ul>"
-    return html
-
 @app.route("/generate_mail/", methods=["GET"])
 def generate():
     session['additional_info'] = ''
     session['questions'] = []
     session['answers'] = {}
+    session.modified = True
     current_user = db.session.execute(db.select(User).where(User.email == session["email"])).scalar()
-    mails = current_user.mails
-    session['summary'] = convert_summary_to_html(agent.summarize_threads(get_mail_thread(mails)).split("**Summary:**")[1])
-    logger.info(f"Summary Generated : {session['summary']}")
-    question_dict = agent.run_email_assistant(session['summary'], session["style_hint"], session['name'], session["additional_info"])
-    logger.info(f"Received questions {question_dict}")
-    reply = "Gathering info..."
+    mails = mail_store.load_thread(current_user.id, current_user.currentThread)
+    thread_text = tasks.get_mail_thread(mails)
+    cached_summary = summary_cache.lookup(thread_text)
+    logger.info(f"Summary cache : {summary_cache.stats()}")
+    exemplars = style_index.exemplars_for(current_user)
+    user_id = current_user.id
+
+    def save_summary(result):
+        if cached_summary is None:
+            summary_cache.store(thread_text, result["raw_summary"])
+        return result
+
+    def score_reply(result):
+        # Parsed once the job is done, so spaCy is not on the path to the drafted reply
+        if result.get("reply"):
+            drift = style_index.score_drift(user_id, agent.analyzer.extract_vector(result["reply"]))
+            logger.info(f"Style drift of drafted reply : {drift}")
+
+    try:
+        # Only the thread the user has open needs a reply prepared
+        job_id = job_queue.submit(
+            session["email"], "generate", tasks.prepare_reply, thread_text, cached_summary, session["style_hint"], session['name'], exemplars,
+            on_done=save_summary, then=score_reply, replace=True,
+        )
+    except jobs.JobLimitExceeded as error:
+        # Reached by navigation, so the error is shown on the page rather than as JSON
+        logger.warning(str(error))
+        return render_template("generate_mail.html", mails=mails, job_id=None, error="Too many jobs are running. Please wait a moment and reload the page."), 429
+    return render_template("generate_mail.html", mails=mails, job_id=job_id)
+
+@app.route("/generate_mail/start/<job_id>", methods=["GET"])
+def start_generation(job_id):
+    job = job_queue.get(job_id, session.get("email"))
+    if job is None or job.status != jobs.DONE:
+        return jsonify({"error": "Job not ready"}), 404
+    session['summary'] = job.result["summary"]
+    question_dict = job.result["questions"]
     next_question = "Generated mail.."
+    stream_reply = False
     if question_dict != "FINAL ANSWER":
         for i, question in question_dict.items():
             session['questions'].append(question)
         next_question = session['questions'][0] 
+    elif job.result.get("reply"):
+        logger.info("Using the speculatively drafted reply")
+        return jsonify({"summary": session['summary'], "question": "Reply generated...", "reply": job.result["reply"]})
     else:
-        reply = agent.generate_email_reply(session['summary'], session["style_hint"], session["additional_info"])
+        stream_reply = True
     session.modified = True        
 
-    return render_template("generate_mail.html", mails=mails, summary=session['summary'], question = next_question, reply = reply)
+    return jsonify({"summary": session['summary'], "question": next_question, "stream": stream_reply})
+
+@app.route("/prefetch_thread/<threadID>", methods=["GET"])
+def prefetch_thread(threadID):
+    email = session["email"]
+    if job_queue.has_active(email, "prefetch"):
+        return jsonify({"status": "busy"}), 429
+    user_id = db.session.execute(db.select(User.id).where(User.email == email)).scalar()
+    stored = mail_store.load_thread(user_id, threadID)
+    if stored and summary_cache.contains(tasks.get_mail_thread(stored)):
+        return jsonify({"status": "cached"})
+    credentials = authenticate.get_credentials(email)
+    if credentials is None:
+        return jsonify({"error": "Gmail access not authorized"}), 401
+
+    def save_prefetch(result):
+        mail_store.save_messages(user_id, result["mails"])
+        # Key the summary on exactly the text /generate_mail/ will build from storage
+        thread_text = tasks.get_mail_thread(mail_store.load_thread(user_id, threadID))
+        summary_cache.store(thread_text, result["raw_summary"])
+        return {"status": 200}
+
+    try:
+        job_id = job_queue.submit(email, "prefetch", tasks.prefetch_thread, credentials.to_json(), threadID, on_done=save_prefetch)
+    except jobs.JobLimitExceeded as error:
+        logger.warning(str(error))
+        return jsonify({"status": "busy"}), 429
+    return jsonify({"job_id": job_id}), 202
 
-def get_mail_thread(mails):
-    thread = ""
-    for mail in mails:
-        thread += f"From: {mail['SenderName']} \nSubject: {mail['subject']}\n{mail['body']}\n\n"
-    return thread
+def strip_final_answer(chunks):
+    """
+    Removes the leading "FINAL ANSWER:" marker from a stream of reply chunks.
+    Chunks are buffered only until the marker has been seen or ruled out.
+    """
+    prefix = "FINAL ANSWER:"
+    buffer = ""
+    chunks = iter(chunks)
+    for chunk in chunks:
+        buffer += chunk
+        stripped = buffer.lstrip()
+        if len(stripped) >= len(prefix) or not prefix.startswith(stripped):
+            break
+    yield re.sub(r"^\s*FINAL ANSWER:\s*", "", buffer)
+    for chunk in chunks:
+        yield chunk
+
+@app.route("/stream_reply")
+def stream_reply():
+    summary = session['summary']
+    style_hint = session["style_hint"]
+    additional_info = session["additional_info"]
+    user_id = session["user_id"]
+    exemplars = style_index.exemplars_for(db.session.get(User, user_id))
+
+    def events():
+        reply = ""
+        for chunk in strip_final_answer(agent.stream_email_reply(summary, style_hint, additional_info, exemplars)):
+            reply += chunk
+            yield f"data: {json.dumps(chunk)}\n\n"
+        logger.info("*************\nReply generated :\n" + reply)
+        yield "event: done\ndata: {}\n\n"
+        # Scored after the client has the whole reply, so parsing it adds no latency
+        logger.info(f"Style drift of streamed reply : {style_index.score_drift(user_id, agent.analyzer.extract_vector(reply))}")
+
+    return Response(stream_with_context(events()), mimetype="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
 @app.route("/home")
 def home():
@@ -210,23 +402,19 @@ def home():
         logger.warning("User not logged in, redirecting to login...")
         return render_template("login.html", session=True, message="Please log in first!")
     credentials = authenticate.get_credentials(session["email"])
-    logger.info(f"Credentials Stored : {credentials}")
-    if credentials == "NOT SET":
+    if credentials is None:
         logger.warning("No valid credentials found in session, redirecting to authorization...")
         return redirect(url_for('authorization'))
-    else:
-        session['credentials'] = credentials
-            
     return redirect(url_for('search_window'))
 
 @app.route("/authorize")
 def authorization():
     logger.info("Authorizing...")
-    if "credentials" in session:
-        creds = Credentials.from_authorized_user_info(json.loads(session["credentials"]))
-        if creds and creds.valid and creds.expired == False and creds.refresh_token:
+    # Credentials live encrypted in the users table, never in the session
+    if "email" in session:
+        creds = authenticate.get_credentials(session["email"])
+        if creds and creds.valid and creds.refresh_token:
             logger.info("Already authorized, redirecting to home...")
-            logger.info(f"Credentials: {session['credentials']}")
             return redirect(url_for('home'))
     authorization_url, state = authenticate.authorize()
     session['state'] = state
@@ -247,8 +435,7 @@ def oauth2callback():
         logger.error("State mismatch. Possible CSRF attack.")
         return redirect(url_for('authorization'))
     credentials = authenticate.callback(session['state'], request.args.get('code'))
-    session['credentials'] = credentials
-    logger.info(f"Credentials received: {credentials}")
+    logger.info("Credentials received")
     creds = Credentials.from_authorized_user_info(json.loads(credentials))
     if not creds.refresh_token:
         logger.warning("Refresh token not present. Re-authorizing...")
@@ -258,9 +445,11 @@ def oauth2callback():
     current_user = db.session.execute(db.select(User).where(User.email == session['email'])).scalar()
     current_user.credentials = authenticate.encrypt_token(credentials, os.environ.get("encryption_key"))
     db.session.commit()
-    session["credentials"] = credentials
+    authenticate.forget_credentials(session['email'])
     return redirect(url_for('home'))
 
 if __name__ == "__main__":
+    if os.environ.get("WARM_UP_MODELS", "false").lower() == "true":
+        agent.warm_up()
     app.run(debug=False, threaded=True, use_reloader=False)
     session.clear()
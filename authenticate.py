@@ -7,7 +7,10 @@ from db import db
 from cryptography.hazmat.primitives.ciphers.aead import AESGCM
 import os
 import base64
+import threading
+from datetime import datetime, timedelta
 from models import User
+from service_cache import services
 from dotenv import load_dotenv
 import logging
 
@@ -74,21 +77,97 @@ def decrypt_token(encrypted_token: str, key_b64: str) -> str:
 
     return decrypted.decode()
 
-def get_credentials(email):
+# Live Credentials objects by user email, so requests skip the DB read,
+# AES-GCM decrypt and JSON parsing while the access token is still fresh.
+REFRESH_MARGIN = timedelta(minutes=5)
+_credentials = {}
+_locks = {}
+_locks_lock = threading.Lock()
+
+def _user_lock(email):
+    with _locks_lock:
+        return _locks.setdefault(email, threading.Lock())
+
+def _expires_soon(creds):
+    return creds.expiry is not None and creds.expiry - datetime.utcnow() < REFRESH_MARGIN
+
+def _save_credentials(email, creds):
     current_user = db.session.execute(db.select(User).where(User.email == email)).scalar()
-    credentials = current_user.credentials
-    if credentials == "NOT SET":
-        return "NOT SET"
-    else:
-        credentials = decrypt_token(current_user.credentials, os.environ.get("encryption_key"))
-        creds = google.oauth2.credentials.Credentials.from_authorized_user_info(json.loads(credentials))
-        if not creds:
-            logger.warning("Invalid credentials in session")
-            return None
-        elif creds.expired and creds.refresh_token:
-            logger.info("Refreshing credentials from session...")
-            creds.refresh(Request())
-            logger.info("Token refreshed successfully.")
-            current_user.credentials = encrypt_token(creds.to_json(), os.environ.get("encryption_key"))
-            db.session.commit()
-        return creds.to_json()
\ No newline at end of file
+    current_user.credentials = encrypt_token(creds.to_json(), os.environ.get("encryption_key"))
+    db.session.commit()
+
+def _refresh(email, creds):
+    """
+    Refreshes a copy of creds so requests using the current object are not
+    disturbed, then stores and caches the new token.
+    """
+    logger.info("Refreshing credentials...")
+    fresh = google.oauth2.credentials.Credentials.from_authorized_user_info(json.loads(creds.to_json()))
+    fresh.refresh(Request())
+    logger.info("Token refreshed successfully.")
+    _save_credentials(email, fresh)
+    services.invalidate(creds)
+    _credentials[email] = fresh
+    return fresh
+
+def _refresh_in_background(email, creds):
+    lock = _user_lock(email)
+    # Single flight: if a refresh for this user is already running, use the current token
+    if not lock.acquire(blocking=False):
+        return
+    app = flask.current_app._get_current_object()
+
+    def run():
+        try:
+            with app.app_context():
+                _refresh(email, creds)
+        except Exception as error:
+            logger.error(f"Background token refresh failed: {error}")
+        finally:
+            lock.release()
+
+    threading.Thread(target=run, name="credential-refresh", daemon=True).start()
+
+def _load(email):
+    current_user = db.session.execute(db.select(User).where(User.email == email)).scalar()
+    if current_user.credentials == "NOT SET":
+        return None
+    credentials = decrypt_token(current_user.credentials, os.environ.get("encryption_key"))
+    creds = google.oauth2.credentials.Credentials.from_authorized_user_info(json.loads(credentials))
+    if not creds:
+        logger.warning("Invalid credentials stored for user")
+        return None
+    if creds.expired and creds.refresh_token:
+        creds = _refresh(email, creds)
+    _credentials[email] = creds
+    return creds
+
+def get_credentials(email):
+    """
+    Returns live Credentials for the user, or None if they have not authorized
+    Gmail access yet.
+
+    Credentials are cached in process. A token close to expiry is refreshed in
+    the background while the current one is still handed out. Only an expired
+    or uncached token makes the caller wait, and concurrent callers for the
+    same user share a single load or refresh.
+    """
+    creds = _credentials.get(email)
+    if creds is not None and creds.valid:
+        if _expires_soon(creds) and creds.refresh_token:
+            _refresh_in_background(email, creds)
+        return creds
+
+    with _user_lock(email):
+        creds = _credentials.get(email)
+        if creds is not None and creds.valid:
+            return creds
+        if creds is not None and creds.refresh_token:
+            return _refresh(email, creds)
+        return _load(email)
+
+def forget_credentials(email):
+    """
+    Drops the cached credentials, e.g. after the user re-authorizes.
+    """
+    _credentials.pop(email, None)
@@ -0,0 +1,63 @@
+"""
+Benchmarks fetching message metadata one request at a time against
+get_messages.batch_get_messages, over fake_gmail.FakeGmailHttp answering
+after a fixed round-trip delay. No network or credentials needed.
+
+Usage:
+    python bench/bench_batch_fetch.py --counts 10 50 100 200 --latency 0.05
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from googleapiclient.discovery import build
+from fake_gmail import FakeGmailHttp
+from get_messages import batch_get_messages
+
+def fake_service(count, latency, failing):
+    http = FakeGmailHttp(latency, failing)
+    for i in range(count):
+        http.add_message(f"m{i:05d}", subject=f"Subject of m{i:05d}", body="Quarterly numbers attached, let me know what you think")
+    return http, build('gmail', 'v1', http=http, static_discovery=True)
+
+def fetch_sequential(service, message_ids):
+    """The previous approach: one blocking messages().get per ID."""
+    results = []
+    for message_id in message_ids:
+        try:
+            results.append(service.users().messages().get(userId='me', id=message_id, format='metadata').execute())
+        except Exception:
+            results.append(None)
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--counts", type=int, nargs="+", default=[10, 50, 100, 200])
+    parser.add_argument("--latency", type=float, default=0.05, help="Seconds per HTTP round trip")
+    parser.add_argument("--fail-every", type=int, default=25, help="Every nth message returns 404")
+    args = parser.parse_args()
+
+    print(f"{'messages':>8} {'sequential':>12} {'batched':>10} {'round trips':>12} {'failed':>7} {'same order':>11}")
+    for count in args.counts:
+        message_ids = [f"m{i:05d}" for i in range(count)]
+        failing = message_ids[args.fail_every - 1::args.fail_every] if args.fail_every else []
+
+        http, service = fake_service(count, args.latency, failing)
+        start = time.perf_counter()
+        sequential = fetch_sequential(service, message_ids)
+        sequential_time = time.perf_counter() - start
+
+        http, service = fake_service(count, args.latency, failing)
+        start = time.perf_counter()
+        batched = batch_get_messages(service, message_ids, format='metadata')
+        batched_time = time.perf_counter() - start
+
+        same = [m and m['id'] for m in sequential] == [m and m['id'] for m in batched]
+        failed = sum(1 for m in batched if m is None)
+        print(f"{count:>8} {sequential_time:>11.2f}s {batched_time:>9.2f}s {http.round_trips:>12} {failed:>7} {str(same):>11}")
+
+if __name__ == "__main__":
+    main()
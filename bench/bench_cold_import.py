@@ -0,0 +1,49 @@
+"""
+Benchmarks cold start of the agent module. Each scenario runs in a fresh
+interpreter, so nothing is cached between runs:
+
+    before      what importing agent used to do: load the full spaCy
+                pipeline and build the Groq client at import time
+    import      importing agent now, with both created lazily
+    first use   importing agent, then loading the pipeline on first use
+
+Usage:
+    python bench/bench_cold_import.py --runs 5
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+SCENARIOS = [
+    ("before", "import agent, spacy; from groq import Groq; spacy.load('en_core_web_sm'); Groq(api_key='bench')"),
+    ("import", "import agent"),
+    ("first use", "import agent; agent.get_nlp()"),
+]
+
+def run(code):
+    start = time.perf_counter()
+    subprocess.run([sys.executable, "-c", code], cwd=ROOT, check=True)
+    return time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    # The Groq client is never created by the lazy scenarios, so no key is needed
+    os.environ.setdefault("USE_FAKE_LLM", "true")
+    # One untimed run so the first scenario does not pay for a cold disk cache
+    run("import agent, spacy, groq")
+
+    print(f"{'scenario':<10} {'median':>8} {'min':>8} {'max':>8}")
+    for name, code in SCENARIOS:
+        times = [run(code) for _ in range(args.runs)]
+        print(f"{name:<10} {statistics.median(times):>7.2f}s {min(times):>7.2f}s {max(times):>7.2f}s")
+
+if __name__ == "__main__":
+    main()
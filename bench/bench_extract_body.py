@@ -0,0 +1,82 @@
+"""
+Benchmarks message body extraction on synthetic multipart messages of
+several megabytes. Reports time and peak traced memory of
+get_messages.extract_body against the previous approach, which decoded
+the whole first text part and returned it verbatim.
+
+Usage:
+    python bench/bench_extract_body.py --megabytes 1 5 20
+"""
+import argparse
+import base64
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from get_messages import extract_body
+
+def encode(text):
+    return base64.urlsafe_b64encode(text.encode('utf-8')).decode('ascii')
+
+def make_payload(megabytes):
+    """
+    Builds a multipart/mixed message: an HTML part first, then a
+    multipart/alternative with plain text, plus a large attachment.
+    """
+    paragraph = "Thanks for the update on the quarterly numbers, see my notes below. " * 10
+    size = megabytes * 1024 * 1024
+    plain = (paragraph + "\n\n") * (size // (len(paragraph) + 2))
+    plain += "\nOn Mon, Someone wrote:\n" + "> quoted line\n" * 1000
+    html = "<html><style>p{}</style>" + f"<p>{paragraph}</p>" * (size // (len(paragraph) + 7)) + "</html>"
+    return {
+        'mimeType': 'multipart/mixed',
+        'parts': [
+            {'mimeType': 'text/html', 'body': {'data': encode(html)}},
+            {'mimeType': 'multipart/alternative', 'parts': [
+                {'mimeType': 'text/plain', 'body': {'data': encode(plain)}},
+            ]},
+            {'mimeType': 'application/pdf', 'body': {'attachmentId': 'a1', 'size': size}},
+        ],
+    }
+
+def extract_body_previous(payload):
+    if 'parts' in payload:
+        for part in payload['parts']:
+            result = extract_body_previous(part)
+            if result:
+                return result
+    else:
+        mime_type = payload.get('mimeType')
+        body_data = payload.get('body', {}).get('data')
+        if body_data and (mime_type == 'text/plain' or mime_type == 'text/html'):
+            return base64.urlsafe_b64decode(body_data).decode('utf-8', errors='ignore')
+    return None
+
+def measure(fn, payload, repeat):
+    tracemalloc.start()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = fn(payload)
+    elapsed = (time.perf_counter() - start) / repeat
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return elapsed, peak, len(result or "")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--megabytes", type=int, nargs="+", default=[1, 5, 20])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{'size':>6} {'function':<10} {'time':>10} {'peak memory':>12} {'chars':>10}")
+    for megabytes in args.megabytes:
+        payload = make_payload(megabytes)
+        for name, fn in (("previous", extract_body_previous), ("current", extract_body)):
+            elapsed, peak, chars = measure(fn, payload, args.repeat)
+            print(f"{megabytes:>4}MB {name:<10} {elapsed * 1000:>8.1f}ms {peak / 1024 / 1024:>10.1f}MB {chars:>10}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""
+Benchmarks login throughput through passwords.verify_password: client
+threads, standing in for request threads, verify passwords concurrently on
+the bcrypt process pool. For comparison the same threads also run
+bcrypt.checkpw inline, as logins did before the pool.
+
+Reports logins per second, logins per second per core, and latency
+percentiles. The work factor and pool size come from --rounds and
+--workers, which set BCRYPT_ROUNDS and BCRYPT_WORKERS.
+
+Usage:
+    python bench/bench_logins.py --rounds 12 --threads 32 --logins 200
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+def measure(name, login, threads, logins, cores):
+    latencies = []
+
+    def timed_login(_):
+        start = time.perf_counter()
+        login()
+        latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        list(executor.map(timed_login, range(logins)))
+    elapsed = time.perf_counter() - start
+    rate = logins / elapsed
+    print(
+        f"{name:<8} {rate:>10.1f} {rate / cores:>9.1f} "
+        f"{statistics.median(latencies) * 1000:>8.0f}ms {percentile(latencies, 0.99) * 1000:>8.0f}ms"
+    )
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rounds", type=int, default=12, help="bcrypt work factor")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="bcrypt process pool size")
+    parser.add_argument("--threads", type=int, default=32, help="Concurrent client threads")
+    parser.add_argument("--logins", type=int, default=200)
+    args = parser.parse_args()
+
+    # Read by passwords at import time
+    os.environ["BCRYPT_ROUNDS"] = str(args.rounds)
+    os.environ["BCRYPT_WORKERS"] = str(args.workers)
+    import bcrypt
+    import passwords
+
+    cores = os.cpu_count() or 1
+    hashed = passwords.hash_password("correct horse battery staple")
+    # Concurrent verifications start every pool worker, so process start-up is not timed
+    with ThreadPoolExecutor(max_workers=args.workers) as executor:
+        list(executor.map(lambda _: passwords.verify_password("correct horse battery staple", hashed), range(args.workers)))
+
+    print(f"rounds={args.rounds} workers={args.workers} threads={args.threads} cores={cores}")
+    print(f"{'mode':<8} {'logins/s':>10} {'per core':>9} {'p50':>10} {'p99':>10}")
+    measure("pool", lambda: passwords.verify_password("correct horse battery staple", hashed), args.threads, args.logins, cores)
+    measure("inline", lambda: bcrypt.checkpw(b"correct horse battery staple", hashed.encode('utf-8')), args.threads, args.logins, cores)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""
+Benchmarks the local full-text search index: bulk indexing throughput,
+per-message sync updates, and search latency percentiles.
+
+Usage:
+    python bench/bench_mail_index.py --users 10 --messages 10000
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from flask import Flask
+from db import db
+import mail_index
+
+WORDS = (
+    "budget review meeting invoice project deadline contract proposal schedule "
+    "quarterly report launch partner sandbox access dashboard analytics feedback "
+    "design hiring travel expenses approval release roadmap customer support"
+).split()
+
+def make_message(index, rng):
+    return {
+        'id': f"m{index:08d}",
+        'threadId': f"t{index // 4:08d}",
+        'subject': " ".join(rng.choices(WORDS, k=5)),
+        'SenderName': rng.choice(["Alice", "Bob", "Carol", "Dave"]),
+        'SenderMail': "sender@example.com",
+        'body': " ".join(rng.choices(WORDS, k=200)),
+        'snippet': "",
+        'date': 1_700_000_000_000 + index * 1000,
+    }
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=10)
+    parser.add_argument("--messages", type=int, default=10000, help="Messages per user")
+    parser.add_argument("--queries", type=int, default=500)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    with tempfile.TemporaryDirectory() as directory:
+        app = Flask(__name__)
+        app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{os.path.join(directory, 'bench.db')}"
+        db.init_app(app)
+        mail_index.init_app(app)
+
+        with app.app_context():
+            users = [f"user{n}@example.com" for n in range(args.users)]
+            start = time.perf_counter()
+            for user in users:
+                mail_index.index_messages(user, [make_message(i, rng) for i in range(args.messages)], complete=True)
+            elapsed = time.perf_counter() - start
+            total = args.users * args.messages
+            print(f"Indexed {total} messages in {elapsed:.1f}s ({total / elapsed:.0f} messages/s)")
+
+            # An incremental sync replaces a handful of messages of one user
+            sync_times = []
+            for _ in range(50):
+                batch = [make_message(rng.randrange(args.messages), rng) for _ in range(20)]
+                start = time.perf_counter()
+                mail_index.index_messages(rng.choice(users), batch)
+                sync_times.append(time.perf_counter() - start)
+            print(f"Sync of 20 messages: p50 {statistics.median(sync_times) * 1000:.2f} ms, p99 {percentile(sync_times, 0.99) * 1000:.2f} ms")
+
+            search_times = []
+            for _ in range(args.queries):
+                query = " ".join(rng.choices(WORDS, k=rng.randint(1, 2)))[:rng.randint(3, 12)]
+                start = time.perf_counter()
+                mail_index.search(rng.choice(users), query)
+                search_times.append(time.perf_counter() - start)
+            print(f"Search over {total} messages: p50 {statistics.median(search_times) * 1000:.2f} ms, p99 {percentile(search_times, 0.99) * 1000:.2f} ms")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""
+Checks and times tasks.sync_mailbox against fake_gmail.FakeGmailHttp.
+Every scenario starts from a synced mailbox, applies changes through the
+fake's history and compares what the incremental sync returns with what
+should be indexed:
+
+    added        new messages
+    trashed      messages moved to the bin or marked as spam
+    restored     messages taken out of the bin or spam again
+    transient    messages added and deleted between two syncs
+    expired      history too old, answered with a full resync
+
+Usage:
+    python bench/bench_mailbox_sync.py --messages 1000 --changes 200 --latency 0.02
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from googleapiclient.discovery import build
+from fake_gmail import FakeGmailHttp
+import tasks
+
+def make_mailbox(count, latency):
+    http = FakeGmailHttp(latency)
+    for i in range(count):
+        http.add_message(f"m{i:06d}", subject=f"Subject {i}", body=f"Message number {i}", date=1_700_000_000_000 + i * 1000)
+    return http, build('gmail', 'v1', http=http, static_discovery=True)
+
+def apply_changes(http, scenario, changes, rng):
+    """Applies changes and returns the IDs the sync should add and delete."""
+    existing = sorted(http.messages)
+    added, deleted = set(), set()
+    for i in range(changes):
+        if scenario == "added":
+            message_id = f"new{i:06d}"
+            http.add_message(message_id, body=f"New message {i}")
+            added.add(message_id)
+        elif scenario == "trashed":
+            message_id = existing[i]
+            http.add_labels(message_id, [rng.choice(["TRASH", "SPAM"])])
+            deleted.add(message_id)
+        elif scenario == "restored":
+            message_id = existing[i]
+            label = rng.choice(["TRASH", "SPAM"])
+            http.add_labels(message_id, [label])
+            http.remove_labels(message_id, [label])
+            added.add(message_id)
+        elif scenario == "transient":
+            message_id = f"tmp{i:06d}"
+            http.add_message(message_id, body=f"Draft {i}")
+            http.delete_message(message_id)
+            deleted.add(message_id)
+    return added, deleted
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=1000, help="Messages in the mailbox")
+    parser.add_argument("--changes", type=int, default=200, help="Changes per scenario")
+    parser.add_argument("--latency", type=float, default=0.02, help="Seconds per HTTP round trip")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    print(f"{'scenario':<10} {'time':>8} {'round trips':>12} {'added':>6} {'deleted':>8} {'full':>5} {'correct':>8}")
+    for scenario in ["added", "trashed", "restored", "transient", "expired"]:
+        http, service = make_mailbox(args.messages, args.latency)
+        history_id = str(http.history_id)
+        if scenario == "expired":
+            http.add_message("after-expiry", body="Sent after the history expired")
+            http.expire_history()
+            expected_added, expected_deleted = None, set()
+        else:
+            expected_added, expected_deleted = apply_changes(http, scenario, args.changes, rng)
+
+        http.round_trips = 0
+        start = time.perf_counter()
+        result = tasks.sync_mailbox(None, history_id, max_results=args.messages + 2, service=service)
+        elapsed = time.perf_counter() - start
+
+        added = {message['id'] for message in result['messages']}
+        deleted = set(result['deleted'])
+        if scenario == "expired":
+            correct = result['full'] and result['complete'] and added == set(http.messages)
+        else:
+            correct = not result['full'] and added == expected_added and deleted == expected_deleted
+        correct = correct and result['history_id'] == str(http.history_id)
+        print(
+            f"{scenario:<10} {elapsed * 1000:>6.0f}ms {http.round_trips:>12} {len(added):>6} {len(deleted):>8} "
+            f"{str(result['full']):>5} {str(correct):>8}"
+        )
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+"""
+Checks the single-pass style counts against the previous implementation,
+which ran textstat and two regular expressions over the raw text, and
+compares their speed. Both use the same spaCy parse, so the timings cover
+only the counting step that changed.
+
+For every feature the report shows the mean and largest absolute
+difference over all messages, and the largest difference relative to the
+old value. The counts that changed (syllables, polysyllables, contractions,
+emojis) are also compared in total.
+
+Usage:
+    python bench/bench_style_features.py --messages 2000
+    python bench/bench_style_features.py --corpus sent_mail.txt
+"""
+import argparse
+import os
+import random
+import re
+import sys
+import time
+from collections import Counter
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import textstat
+import agent
+
+SENTENCES = [
+    "Thanks for sending the quarterly report over so quickly!",
+    "I don't think we'll be able to make the Thursday meeting.",
+    "Could you double-check the figures in the appendix?",
+    "It's been a while since we last caught up, hasn't it?",
+    "The committee's recommendation was approved unanimously yesterday.",
+    "Let's grab lunch next week 🙂",
+    "We're gonna need the revised proposal by Friday, legit no later.",
+    "Honestly, the implementation is considerably more complicated than anticipated.",
+    "She'd already forwarded the invoice to accounting — no worries.",
+    "Attached are the onboarding materials & the updated org chart.",
+    "lol yeah that's fine by me 👍",
+    "Please review the documentation at https://example.com/docs/v2 before Monday.",
+    "The O'Brien account is up for renewal; however, pricing hasn't been finalized.",
+    "I'll circle back once I've heard from the legal team.",
+    "Unfortunately, the responsibilities were reassigned because of organizational restructuring.",
+    "Can't wait to see everyone at the offsite!!",
+]
+
+def synthetic_corpus(count, seed):
+    rng = random.Random(seed)
+    return [" ".join(rng.choices(SENTENCES, k=rng.randint(2, 12))) for _ in range(count)]
+
+def read_corpus(path):
+    """Reads messages from a text file, separated by lines containing only ---."""
+    with open(path, encoding="utf-8") as f:
+        return [m.strip() for m in re.split(r"^---$", f.read(), flags=re.MULTILINE) if m.strip()]
+
+def old_counts_from_doc(analyzer, doc, text):
+    """The counting step as it was before syllables and markers came from tokens."""
+    words = []
+    characters = connectives = clauses = passives = informal_words = 0
+    pos_counts = Counter()
+    for token in doc:
+        pos_counts[token.pos_] += 1
+        if token.lower_ in analyzer.connectives:
+            connectives += 1
+        if token.dep_ in ("ccomp", "advcl", "relcl"):
+            clauses += 1
+        elif token.dep_ == "auxpass":
+            passives += 1
+        if token.is_alpha:
+            words.append(token.text)
+            characters += len(token.text)
+            if token.lower_ in analyzer.informal_words:
+                informal_words += 1
+
+    return {
+        'words': len(words),
+        'sentences': sum(1 for _ in doc.sents),
+        'characters': characters,
+        'syllables': textstat.syllable_count(text),
+        'polysyllables': textstat.polysyllabcount(text),
+        'connectives': connectives,
+        'pronouns': pos_counts["PRON"],
+        'clauses': clauses,
+        'passives': passives,
+        'informal_words': informal_words,
+        'nouns': pos_counts["NOUN"],
+        'verbs': pos_counts["VERB"],
+        'adjectives': pos_counts["ADJ"],
+        'adverbs': pos_counts["ADV"],
+        'contractions': len(re.findall(r"\b\w+'\w+", text)),
+        'exclamations': text.count("!"),
+        'questions': text.count("?"),
+        'emojis': len(re.findall(r"[^\w\s,.!?;:]", text)),
+        'vocabulary': sorted(set(words)),
+    }
+
+def timed(function, docs, texts):
+    start = time.perf_counter()
+    results = [function(doc, text) for doc, text in zip(docs, texts)]
+    return results, time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=2000, help="Size of the synthetic corpus")
+    parser.add_argument("--corpus", help="Text file of real messages separated by lines containing only ---")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    texts = read_corpus(args.corpus) if args.corpus else synthetic_corpus(args.messages, args.seed)
+    analyzer = agent.analyzer
+    docs = list(agent.get_nlp().pipe(texts))
+    words = sum(1 for doc in docs for token in doc if token.is_alpha)
+    print(f"{len(texts)} messages, {words} words")
+
+    old, old_time = timed(lambda doc, text: old_counts_from_doc(analyzer, doc, text), docs, texts)
+    # The syllable cache would otherwise carry over from an earlier run
+    agent.count_syllables.cache_clear()
+    new, new_time = timed(analyzer.counts_from_doc, docs, texts)
+    _, warm_time = timed(analyzer.counts_from_doc, docs, texts)
+
+    print(f"\n{'counting':<26} {'total':>9} {'per message':>12}")
+    for name, elapsed in [("old (textstat on text)", old_time), ("new (cold cache)", new_time), ("new (warm cache)", warm_time)]:
+        print(f"{name:<26} {elapsed * 1000:>7.1f}ms {elapsed / len(texts) * 1e6:>10.1f}us")
+
+    print(f"\n{'count':<14} {'old total':>10} {'new total':>10} {'messages differing':>19}")
+    for key in ['syllables', 'polysyllables', 'contractions', 'emojis']:
+        differing = sum(1 for a, b in zip(old, new) if a[key] != b[key])
+        print(f"{key:<14} {sum(c[key] for c in old):>10} {sum(c[key] for c in new):>10} {differing:>19}")
+
+    old_features = [analyzer.features_from_counts(c) for c in old]
+    new_features = [analyzer.features_from_counts(c) for c in new]
+    print(f"\n{'feature':<24} {'mean abs diff':>14} {'max abs diff':>13} {'max rel diff':>13}")
+    for name in analyzer.feature_names:
+        diffs = [abs(a[name] - b[name]) for a, b in zip(old_features, new_features)]
+        relative = [d / abs(a[name]) for d, a in zip(diffs, old_features) if a[name]]
+        print(f"{name:<24} {sum(diffs) / len(diffs):>14.4f} {max(diffs):>13.4f} {max(relative, default=0):>12.1%}")
+
+    # The aggregate profile is what replies are conditioned on
+    old_total, new_total = {}, {}
+    for a, b in zip(old, new):
+        old_total = analyzer.merge_counts(old_total, a)
+        new_total = analyzer.merge_counts(new_total, b)
+    old_profile = analyzer.features_from_counts(old_total)
+    new_profile = analyzer.features_from_counts(new_total)
+    print(f"\n{'profile feature':<24} {'old':>9} {'new':>9}")
+    for name in analyzer.feature_names:
+        print(f"{name:<24} {old_profile[name]:>9.4f} {new_profile[name]:>9.4f}")
+
+if __name__ == "__main__":
+    main()
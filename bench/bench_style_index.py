@@ -0,0 +1,61 @@
+"""
+Benchmarks the per-user style index: build time, and nearest-neighbour and
+drift query latency percentiles over synthetic style vectors. The vectors
+are random but have the real number of features and weights.
+
+Usage:
+    python bench/bench_style_index.py --sizes 500 2000 10000 --queries 2000
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import numpy as np
+import agent
+from style_index import StyleIndex, EXEMPLAR_COUNT
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+def timed_queries(query, vectors):
+    latencies = []
+    for vector in vectors:
+        start = time.perf_counter()
+        query(vector)
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[500, 2000, 10000], help="Exemplars per index")
+    parser.add_argument("--queries", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    weights = agent.analyzer.weights
+    features = len(weights)
+    print(f"{features} features, k={EXEMPLAR_COUNT}")
+    print(f"{'vectors':>8} {'build':>9} {'nearest p50':>12} {'nearest p99':>12} {'drift p50':>10} {'drift p99':>10}")
+    for size in args.sizes:
+        vectors = rng.normal(loc=1.0, scale=0.5, size=(size, features)).astype(np.float32)
+        ids = [f"m{i:08d}" for i in range(size)]
+        start = time.perf_counter()
+        index = StyleIndex(ids, [""] * size, vectors, weights)
+        build = time.perf_counter() - start
+
+        queries = rng.normal(loc=1.0, scale=0.5, size=(args.queries, features)).astype(np.float32)
+        nearest = timed_queries(index.nearest, queries)
+        drift = timed_queries(index.drift, queries)
+        print(
+            f"{size:>8} {build * 1000:>7.2f}ms "
+            f"{percentile(nearest, 0.5) * 1e6:>10.1f}us {percentile(nearest, 0.99) * 1e6:>10.1f}us "
+            f"{percentile(drift, 0.5) * 1e6:>8.1f}us {percentile(drift, 0.99) * 1e6:>8.1f}us"
+        )
+
+if __name__ == "__main__":
+    main()
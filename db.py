@@ -1,5 +1,4 @@
 from flask_sqlalchemy import SQLAlchemy
-import os
 
 db = SQLAlchemy()
 
@@ -8,6 +7,21 @@ def init_app(app):
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
     db.init_app(app)
 
-    if (os.path.exists('instance/users.db')) == False:
-        with app.app_context():
-            db.create_all()
\ No newline at end of file
+    # create_all only creates missing tables, so it also adds new tables to an existing database
+    with app.app_context():
+        db.create_all()
+        add_missing_columns()
+
+def add_missing_columns():
+    """
+    Adds columns that were introduced after a table was created. create_all
+    never alters existing tables, and new columns are all nullable.
+    """
+    inspector = db.inspect(db.engine)
+    for table in db.metadata.sorted_tables:
+        existing = {column['name'] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in existing:
+                column_type = column.type.compile(dialect=db.engine.dialect)
+                with db.engine.begin() as connection:
+                    connection.execute(db.text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'))
\ No newline at end of file
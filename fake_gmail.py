@@ -0,0 +1,171 @@
+from urllib.parse import urlsplit, parse_qs
+import base64
+import json
+import re
+import time
+import httplib2
+import logging
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+API_PATH = "/gmail/v1/users/me/"
+# Gmail leaves these out of messages.list unless asked for
+HIDDEN_LABELS = {'TRASH', 'SPAM'}
+
+class FakeGmailHttp:
+    """
+    Offline stand-in for the httplib2 transport of a Gmail service, for
+    exercising fetch and sync code without network access or credentials:
+
+        http = FakeGmailHttp()
+        service = build('gmail', 'v1', http=http)
+        http.add_message("m1", subject="Hello", body="Hi there")
+
+    It answers messages.get, messages.list, users.getProfile and
+    history.list, directly or inside batch requests. Changes made through
+    add_message, delete_message, add_labels and remove_labels are recorded
+    in the mailbox history like Gmail does, and expire_history makes older
+    historyIds answer 404.
+
+    Args:
+        latency (float): Seconds to wait per HTTP round trip.
+        failing (iterable): Message IDs that answer 404 to messages.get.
+    """
+    def __init__(self, latency=0.0, failing=()):
+        self.latency = latency
+        self.failing = set(failing)
+        self.messages = {}
+        self.history = []
+        self.history_id = 1000
+        # History starting before this ID has expired
+        self.oldest_history_id = self.history_id
+        self.round_trips = 0
+
+    def _record(self, change, message_id, labels=None):
+        self.history_id += 1
+        message = self.messages[message_id]
+        entry = {'message': {'id': message_id, 'threadId': message['threadId'], 'labelIds': list(message['labelIds'])}}
+        if labels is not None:
+            entry['labelIds'] = list(labels)
+        self.history.append({'id': str(self.history_id), change: [entry]})
+
+    def add_message(self, message_id, thread_id=None, labels=("INBOX",), subject="", body="", sender="Sender <sender@example.com>", date=None):
+        """
+        Adds a message to the mailbox. date is in milliseconds and defaults
+        to the current time.
+        """
+        data = base64.urlsafe_b64encode(body.encode('utf-8')).decode('ascii')
+        self.messages[message_id] = {
+            'id': message_id,
+            'threadId': thread_id or message_id,
+            'labelIds': list(labels),
+            'snippet': body[:100],
+            'internalDate': str(date if date is not None else int(time.time() * 1000)),
+            'payload': {
+                'mimeType': 'text/plain',
+                'headers': [{'name': 'Subject', 'value': subject}, {'name': 'From', 'value': sender}],
+                'body': {'size': len(body), 'data': data},
+            },
+        }
+        self._record('messagesAdded', message_id)
+
+    def delete_message(self, message_id):
+        """Permanently deletes a message."""
+        self._record('messagesDeleted', message_id)
+        del self.messages[message_id]
+
+    def add_labels(self, message_id, labels):
+        """Adds labels, e.g. ["TRASH"] to move a message to the bin."""
+        message = self.messages[message_id]
+        message['labelIds'] = message['labelIds'] + [label for label in labels if label not in message['labelIds']]
+        self._record('labelsAdded', message_id, labels)
+
+    def remove_labels(self, message_id, labels):
+        """Removes labels, e.g. ["SPAM"] when a message is marked as not spam."""
+        message = self.messages[message_id]
+        message['labelIds'] = [label for label in message['labelIds'] if label not in labels]
+        self._record('labelsRemoved', message_id, labels)
+
+    def expire_history(self):
+        """Drops the recorded history, as Gmail does after about a week."""
+        self.history = []
+        self.oldest_history_id = self.history_id
+
+    def _not_found(self, what):
+        return 404, {'error': {'code': 404, 'message': f"{what} not found"}}
+
+    def _answer(self, method, url):
+        """Returns (status, JSON body) for one API call."""
+        parts = urlsplit(url)
+        params = {key: values[-1] for key, values in parse_qs(parts.query).items()}
+        path = parts.path.split(API_PATH, 1)[-1]
+
+        if method == "GET" and path == "profile":
+            return 200, {'emailAddress': 'me@example.com', 'historyId': str(self.history_id)}
+
+        if method == "GET" and path.startswith("messages/"):
+            message_id = path[len("messages/"):]
+            if message_id in self.failing or message_id not in self.messages:
+                return self._not_found("Requested entity")
+            return 200, self.messages[message_id]
+
+        if method == "GET" and path == "messages":
+            labels = set(parse_qs(parts.query).get('labelIds', []))
+            before = re.search(r"before:(\d+)", params.get('q', ''))
+            listed = [
+                message for message in self.messages.values()
+                if not (HIDDEN_LABELS - labels) & set(message['labelIds'])
+                and labels <= set(message['labelIds'])
+                and (before is None or int(message['internalDate']) < int(before.group(1)) * 1000)
+            ]
+            listed.sort(key=lambda message: int(message['internalDate']), reverse=True)
+            return 200, self._page(listed, params, 'messages', lambda m: {'id': m['id'], 'threadId': m['threadId']})
+
+        if method == "GET" and path == "history":
+            start = int(params['startHistoryId'])
+            if start < self.oldest_history_id:
+                return self._not_found("History")
+            records = [record for record in self.history if int(record['id']) > start]
+            response = self._page(records, params, 'history', lambda record: record)
+            response['historyId'] = str(self.history_id)
+            return 200, response
+
+        return self._not_found(f"{method} {path}")
+
+    @staticmethod
+    def _page(items, params, name, convert):
+        offset = int(params.get('pageToken', 0))
+        size = int(params.get('maxResults', 100))
+        response = {name: [convert(item) for item in items[offset:offset + size]]}
+        if offset + size < len(items):
+            response['nextPageToken'] = str(offset + size)
+        return response
+
+    def _answer_batch(self, body, headers):
+        if isinstance(body, bytes):
+            body = body.decode('utf-8')
+        boundary = re.search(r'boundary="?([^";]+)"?', headers['content-type']).group(1)
+        parts = []
+        for part in body.split(f"--{boundary}")[1:-1]:
+            content_id = re.search(r"Content-ID: <([^>]+)>", part, re.IGNORECASE).group(1)
+            method, url = re.search(r"^(GET|POST|PUT|PATCH|DELETE) (\S+) HTTP/1\.1", part, re.MULTILINE).groups()
+            status, content = self._answer(method, url)
+            parts.append(
+                f"--batch_response\r\nContent-Type: application/http\r\nContent-ID: <response-{content_id}>\r\n\r\n"
+                f"HTTP/1.1 {status} {'OK' if status == 200 else 'Not Found'}\r\nContent-Type: application/json\r\n\r\n"
+                f"{json.dumps(content)}\r\n"
+            )
+        return "".join(parts) + "--batch_response--\r\n"
+
+    def request(self, uri, method="GET", body=None, headers=None, redirections=5, connection_type=None):
+        if self.latency:
+            time.sleep(self.latency)
+        self.round_trips += 1
+        if urlsplit(uri).path.startswith("/batch"):
+            content = self._answer_batch(body, headers)
+            response = httplib2.Response({'status': '200', 'content-type': 'multipart/mixed; boundary=batch_response'})
+            return response, content.encode('utf-8')
+        status, content = self._answer(method, uri)
+        response = httplib2.Response({'status': str(status), 'content-type': 'application/json'})
+        return response, json.dumps(content).encode('utf-8')
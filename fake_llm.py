@@ -0,0 +1,88 @@
+from types import SimpleNamespace
+import asyncio
+import re
+import time
+import logging
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+def default_responder(messages, **kwargs):
+    """
+    Builds a canned response that satisfies every prompt in agent.py: it is a
+    final answer (no clarification questions) and contains a summary section.
+    """
+    user_content = messages[-1]["content"].strip()
+    return f"FINAL ANSWER:\n**Summary:**\n* {user_content[:200]}"
+
+class FakeCompletions:
+    def __init__(self, responder, token_delay):
+        self.responder = responder
+        self.token_delay = token_delay
+
+    def create(self, messages, stream=False, **kwargs):
+        content = self.responder(messages, **kwargs)
+        if stream:
+            return self._stream(content)
+        message = SimpleNamespace(role="assistant", content=content)
+        return SimpleNamespace(choices=[SimpleNamespace(message=message, finish_reason="stop")])
+
+    def _stream(self, content):
+        # Emit word-sized chunks (keeping whitespace) like a real token stream
+        for token in re.findall(r"\s*\S+|\s+", content):
+            if self.token_delay:
+                time.sleep(self.token_delay)
+            delta = SimpleNamespace(content=token)
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=delta, finish_reason=None)])
+        delta = SimpleNamespace(content=None)
+        yield SimpleNamespace(choices=[SimpleNamespace(delta=delta, finish_reason="stop")])
+
+class FakeClient:
+    """
+    Offline stand-in for the Groq client, exposing chat.completions.create with
+    and without stream=True.
+
+    Args:
+        responder (callable): Function (messages, **kwargs) -> str producing the reply.
+        token_delay (float): Seconds to wait between streamed chunks.
+    """
+    def __init__(self, responder=default_responder, token_delay=0.0):
+        logger.info("Using fake LLM client")
+        self.chat = SimpleNamespace(completions=FakeCompletions(responder, token_delay))
+
+class FakeStatusError(Exception):
+    """Error carrying an HTTP status code, like the Groq API errors."""
+    def __init__(self, status_code):
+        super().__init__(f"Fake LLM error {status_code}")
+        self.status_code = status_code
+
+class FakeAsyncCompletions:
+    def __init__(self, responder, latency, failures):
+        self.responder = responder
+        self.latency = latency
+        self.failures = list(failures)
+        self.calls = 0
+
+    async def create(self, messages, **kwargs):
+        self.calls += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if self.failures:
+            status = self.failures.pop(0)
+            if status:
+                raise FakeStatusError(status)
+        message = SimpleNamespace(role="assistant", content=self.responder(messages, **kwargs))
+        return SimpleNamespace(choices=[SimpleNamespace(message=message, finish_reason="stop")])
+
+class FakeAsyncClient:
+    """
+    Offline stand-in for the AsyncGroq client, used to exercise the LLM gateway.
+
+    Args:
+        responder (callable): Function (messages, **kwargs) -> str producing the reply.
+        latency (float): Seconds each request takes.
+        failures (list): Status codes to raise on successive calls; None or 0 means succeed.
+    """
+    def __init__(self, responder=default_responder, latency=0.0, failures=()):
+        logger.info("Using fake async LLM client")
+        self.chat = SimpleNamespace(completions=FakeAsyncCompletions(responder, latency, failures))
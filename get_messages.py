@@ -1,41 +1,105 @@
 from google.oauth2.credentials import Credentials
-from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
 import json
 from email.utils import parseaddr
 from base64 import urlsafe_b64decode as decode_base64url
+from contextlib import contextmanager
+from service_cache import lease_service
+from mail_text import html_to_text, strip_quoted
 import logging
 
 # Configure logging
 logger = logging.getLogger(__name__)
- 
+
+# Gmail accepts at most 100 calls per batch request, but recommends staying
+# well under that to avoid rate limiting.
+BATCH_SIZE = 50
+
+# Partial response mask for search results
+SEARCH_FIELDS = 'id,threadId,snippet,payload/headers'
+
+# Bytes of a message body decoded at most; the rest is dropped
+MAX_BODY_BYTES = 200_000
+
+@contextmanager
+def use_service(creds, service=None, background=False):
+    """
+    Yields service if one is given, e.g. built on a fake transport, and
+    otherwise leases the user's cached service.
+    """
+    if service is not None:
+        yield service
+        return
+    with lease_service(creds, background) as leased:
+        yield leased
+
+def batch_get_messages(service, message_ids, **kwargs):
+    """
+    Fetch several messages using the Gmail batch HTTP endpoint instead of one
+    round trip per message.
+
+    Args:
+        service: Gmail service object returned by build().
+        message_ids (list): IDs of the messages to fetch.
+        **kwargs: Extra arguments passed to messages().get (e.g. format='full').
+
+    Returns:
+        list: Message resources in the same order as message_ids. Messages that
+              failed to fetch are returned as None.
+    """
+    results = {}
+
+    def callback(request_id, response, exception):
+        if exception is not None:
+            logger.error(f"Failed to fetch message {request_id}: {exception}")
+            results[request_id] = None
+        else:
+            results[request_id] = response
+
+    for start in range(0, len(message_ids), BATCH_SIZE):
+        batch = service.new_batch_http_request(callback=callback)
+        for message_id in message_ids[start:start + BATCH_SIZE]:
+            batch.add(service.users().messages().get(userId='me', id=message_id, **kwargs), request_id=message_id)
+        batch.execute()
+
+    return [results.get(message_id) for message_id in message_ids]
+
 def get_messages(creds, query):
+    """
+    Lists messages matching query for the search results. Only the ID, thread
+    ID, subject and snippet are requested; bodies are fetched when a thread
+    is opened.
+    """
     logger.info("Getting messages...")
     if not creds or not creds.valid:
         logger.warning("Invalid credentials")
         return []
     try:
-        service = build('gmail', 'v1', credentials=creds)
-        collection = service.users().messages().list(userId='me', q = query, maxResults=10)
-        response = collection.execute()
-        if 'messages' not in response:
-            logger.info("No messages found.")
-            return []
-        ans = []
-        for message in response['messages']:
-            msg = service.users().messages().get(userId='me', id=message['id']).execute()
-            id = msg['id']
-            thread_id = msg['threadId']
-            headers = msg['payload']['headers']
-            subject = next((h['value'] for h in headers if h['name'] == 'Subject'), '(No Subject)')
-            body = msg.get('snippet', '(No Body)')
-            ans.append({
-                'id': id,
-                'threadId': thread_id,
-                'subject': subject,
-                'body': body
-            })
-        return ans
+        with lease_service(creds) as service:
+            received = service.transfer.bytes_received
+            collection = service.users().messages().list(userId='me', q = query, maxResults=10)
+            response = collection.execute()
+            if 'messages' not in response:
+                logger.info("No messages found.")
+                return []
+            ans = []
+            message_ids = [message['id'] for message in response['messages']]
+            for msg in batch_get_messages(service, message_ids, format='metadata', metadataHeaders=['Subject'], fields=SEARCH_FIELDS):
+                if msg is None:
+                    continue
+                id = msg['id']
+                thread_id = msg['threadId']
+                headers = msg['payload']['headers']
+                subject = next((h['value'] for h in headers if h['name'] == 'Subject'), '(No Subject)')
+                body = msg.get('snippet', '(No Body)')
+                ans.append({
+                    'id': id,
+                    'threadId': thread_id,
+                    'subject': subject,
+                    'body': body
+                })
+            logger.info(f"Search transferred {service.transfer.bytes_received - received} bytes for {len(message_ids)} messages")
+            return ans
 
     except HttpError as error:
         logger.error(f'An error occurred: {error}')
@@ -44,63 +108,233 @@ def get_messages(creds, query):
         logger.error(f'Timeout occurred: {error}')
         return get_messages(creds, query)  # Retry on timeout
 
-def get_full_messages(creds, label_ids):
-    logger.info("Getting messages...")
-    if not creds or not creds.valid:
+def iter_messages(creds, query=None, label_ids=None, page_size=100, limit=None, after=None, before=None, skip_ids=(), background=False, service=None):
+    """
+    Lazily walks the mailbox page by page, yielding parsed messages with full
+    bodies as they are fetched. Only one page is held in memory at a time.
+
+    Args:
+        creds: Gmail credentials.
+        query (str): Gmail search query.
+        label_ids (list): Only include messages with all of these labels.
+        page_size (int): Messages listed and fetched per page (at most 500).
+        limit (int): Maximum number of messages to yield, or None for all.
+        after (date): Only include messages sent after this date.
+        before (date): Only include messages sent before this date.
+        skip_ids (set): Message IDs that are listed but not fetched.
+        background (bool): Use the service reserved for background jobs, see
+                           service_cache.ServiceCache.lease.
+        service: Gmail service to use instead of the cached one.
+
+    Yields:
+        dict: Messages as returned by parse_message.
+    """
+    terms = [query] if query else []
+    if after:
+        terms.append(f"after:{after:%Y/%m/%d}")
+    if before:
+        terms.append(f"before:{before:%Y/%m/%d}")
+    query = " ".join(terms) or None
+
+    yielded = 0
+    page_token = None
+    while limit is None or yielded < limit:
+        # The service is only leased per page, so slow consumers do not block other requests
+        with use_service(creds, service, background) as leased:
+            response = leased.users().messages().list(userId='me', q=query, labelIds=label_ids, maxResults=page_size, pageToken=page_token).execute()
+            message_ids = [message['id'] for message in response.get('messages', []) if message['id'] not in skip_ids]
+            if limit is not None:
+                message_ids = message_ids[:limit - yielded]
+            page = batch_get_messages(leased, message_ids, format='full')
+
+        for msg in page:
+            if msg is not None:
+                yielded += 1
+                yield parse_message(msg)
+
+        page_token = response.get('nextPageToken')
+        if not page_token:
+            break
+
+def find_text_part(payload):
+    """
+    Walks the MIME tree without recursion and returns the first text/plain
+    part, falling back to the first text/html part.
+    """
+    html_part = None
+    stack = [payload]
+    while stack:
+        part = stack.pop()
+        if 'parts' in part:
+            # Reversed so parts are visited in their original order
+            stack.extend(reversed(part['parts']))
+            continue
+        if not part.get('body', {}).get('data'):
+            continue
+        mime_type = part.get('mimeType')
+        if mime_type == 'text/plain':
+            return part
+        if mime_type == 'text/html' and html_part is None:
+            html_part = part
+    return html_part
+
+def decode_capped(data, max_bytes=MAX_BODY_BYTES):
+    """
+    Decodes at most max_bytes of a base64url body. Only the needed prefix of
+    the encoded string is decoded, so oversized bodies are never fully
+    materialized.
+    """
+    # Every 4 base64 characters decode to 3 bytes
+    data = data[:(max_bytes + 2) // 3 * 4]
+    data += "=" * (-len(data) % 4)
+    return decode_base64url(data)[:max_bytes].decode('utf-8', errors='ignore')
+
+def extract_body(payload):
+    """
+    Extracts the text the sender wrote from a message payload: plain text is
+    preferred over HTML, HTML is converted to text, and quoted replies and
+    the signature are removed.
+    """
+    part = find_text_part(payload)
+    if part is None:
+        return None
+    text = decode_capped(part['body']['data'])
+    if part.get('mimeType') == 'text/html':
+        text = html_to_text(text)
+    return strip_quoted(text) or None
+
+def parse_message(message):
+    """
+    Converts a Gmail message resource fetched with format='full' into the
+    dictionary used for threads and the search index.
+    """
+    headers = message['payload'].get('headers', [])
+    subject = next((h['value'] for h in headers if h['name'] == 'Subject'), '(No Subject)')
+    from_header = next((h['value'] for h in headers if h['name'].lower() == 'from'), None)
+    sender_name, sender_email = parseaddr(from_header)
+
+    # Extract full body
+    body = extract_body(message['payload']) or "(No Body Found)"
+
+    return {
+        'id': message['id'],
+        'SenderName': sender_name,
+        'SenderMail': sender_email,
+        'threadId': message['threadId'],
+        'subject': subject,
+        'body': body,
+        'snippet': message.get('snippet', ''),
+        'date': int(message.get('internalDate', 0))
+    }
+
+def get_recent_messages(creds, max_results=100, service=None):
+    """
+    Fetches the most recent messages in the mailbox with their full bodies,
+    for building the local search index.
+    """
+    logger.info("Getting recent messages...")
+    if service is None and (not creds or not creds.valid):
         logger.warning("Invalid credentials")
         return []
 
     try:
-        service = build('gmail', 'v1', credentials=creds)
-        collection = service.users().messages().list(userId='me', labelIds=label_ids, maxResults=10)
-        response = collection.execute()
-
-        if 'messages' not in response:
-            logger.info("No messages found.")
-            return []
-
-        ans = []
-        for message in response['messages']:
-            msg = service.users().messages().get(userId='me', id=message['id'], format='full').execute()
-            msg_id = msg['id']
-            thread_id = msg['threadId']
-            headers = msg['payload'].get('headers', [])
-            subject = next((h['value'] for h in headers if h['name'] == 'Subject'), '(No Subject)')
-            
-            # Extract full body content
-            body = extract_body(msg['payload']) or "(No Body Found)"
-
-            ans.append({
-                'id': msg_id,
-                'threadId': thread_id,
-                'subject': subject,
-                'body': body
-            })
-
-        return ans
+        return list(iter_messages(creds, page_size=max_results, limit=max_results, service=service))
 
     except HttpError as error:
         logger.error(f'An error occurred: {error}')
-        return None
-    except TimeoutError as error:
-        logger.error(f'Timeout occurred: {error}')
-        return get_full_messages(creds, label_ids)  # Retry on timeout
-    
-def extract_body(payload):
+        return []
+
+class HistoryExpired(Exception):
+    """Raised when a stored historyId is too old for users.history.list."""
+    pass
+
+# Messages carrying these labels are treated as removed from the mailbox
+HIDDEN_LABELS = {'TRASH', 'SPAM'}
+
+def get_history_id(creds, service=None):
+    """
+    Returns the mailbox's current historyId.
+    """
+    with use_service(creds, service) as leased:
+        return leased.users().getProfile(userId='me').execute()['historyId']
+
+def get_history(creds, start_history_id, service=None):
+    """
+    Lists mailbox changes since start_history_id.
+
+    Args:
+        creds: Gmail credentials.
+        start_history_id (str): historyId of the last sync.
+        service: Gmail service to use instead of the cached one.
+
+    Returns:
+        tuple: (IDs of added or restored messages, IDs of deleted or trashed
+               messages, the latest historyId).
+
+    Raises:
+        HistoryExpired: If Gmail no longer has history for start_history_id.
+    """
+    added = {}
+    deleted = set()
+    history_id = start_history_id
+    page_token = None
+    try:
+        with use_service(creds, service) as leased:
+            while True:
+                response = leased.users().history().list(
+                    userId='me',
+                    startHistoryId=start_history_id,
+                    historyTypes=['messageAdded', 'messageDeleted', 'labelAdded', 'labelRemoved'],
+                    pageToken=page_token
+                ).execute()
+                # Records are in chronological order, so later changes win
+                for record in response.get('history', []):
+                    for change in record.get('messagesAdded', []):
+                        if not HIDDEN_LABELS & set(change['message'].get('labelIds', [])):
+                            added[change['message']['id']] = True
+                    for change in record.get('labelsRemoved', []):
+                        if HIDDEN_LABELS & set(change.get('labelIds', [])):
+                            added[change['message']['id']] = True
+                    for change in record.get('messagesDeleted', []) + record.get('labelsAdded', []):
+                        if 'labelIds' in change and not HIDDEN_LABELS & set(change['labelIds']):
+                            continue
+                        added.pop(change['message']['id'], None)
+                        deleted.add(change['message']['id'])
+                history_id = response.get('historyId', history_id)
+                page_token = response.get('nextPageToken')
+                if not page_token:
+                    break
+    except HttpError as error:
+        if error.resp.status == 404:
+            raise HistoryExpired(start_history_id)
+        raise
+
+    deleted -= set(added)
+    return list(added), list(deleted), history_id
+
+def get_messages_by_id(creds, message_ids, service=None):
+    """
+    Fetches and parses the given messages with their full bodies.
+    """
+    with use_service(creds, service) as leased:
+        return [parse_message(msg) for msg in batch_get_messages(leased, message_ids, format='full') if msg is not None]
+
+def get_thread_message_ids(creds, threadID):
     """
-    Recursively extract the email body (plain text or html) from the payload.
+    Lists the IDs of the messages in a thread without downloading them.
     """
-    if 'parts' in payload:
-        for part in payload['parts']:
-            result = extract_body(part)
-            if result:
-                return result
-    else:
-        mime_type = payload.get('mimeType')
-        body_data = payload.get('body', {}).get('data')
-        if body_data and (mime_type == 'text/plain' or mime_type == 'text/html'):
-            return decode_base64url(body_data).decode('utf-8', errors='ignore')
-    return None
+    if not creds or not creds.valid:
+        logger.warning("Invalid credentials")
+        return []
+
+    try:
+        with lease_service(creds) as service:
+            thread_response = service.users().threads().get(userId='me', id=threadID, format='minimal', fields='messages/id').execute()
+            return [message['id'] for message in thread_response.get('messages', [])]
+
+    except HttpError as error:
+        logger.error(f"An error occurred: {error}")
+        return None
 
 def get_thread(creds, threadID):
     if not creds or not creds.valid:
@@ -108,34 +342,16 @@ def get_thread(creds, threadID):
         return []
 
     try:
-        service = build('gmail', 'v1', credentials=creds)
-        thread_response = service.users().threads().get(userId='me', id=threadID, format='full').execute()
+        with lease_service(creds) as service:
+            received = service.transfer.bytes_received
+            thread_response = service.users().threads().get(userId='me', id=threadID, format='full').execute()
+            logger.info(f"Thread fetch transferred {service.transfer.bytes_received - received} bytes")
         
-        if 'messages' not in thread_response:
-            logger.info("No messages found.")
-            return []
+            if 'messages' not in thread_response:
+                logger.info("No messages found.")
+                return []
         
-        ans = []
-        for message in thread_response['messages']:
-            msg_id = message['id']
-            headers = message['payload'].get('headers', [])
-            subject = next((h['value'] for h in headers if h['name'] == 'Subject'), '(No Subject)')
-            from_header = next((h['value'] for h in headers if h['name'].lower() == 'from'), None)
-            sender_name, sender_email = parseaddr(from_header)
-
-            # Extract full body
-            body = extract_body(message['payload']) or "(No Body Found)"
-
-            ans.append({
-                'id': msg_id,
-                'SenderName': sender_name,
-                'SenderMail': sender_email,
-                'threadId': message['threadId'],
-                'subject': subject,
-                'body': body
-            })
-
-        return ans
+            return [parse_message(message) for message in thread_response['messages']]
 
     except HttpError as error:
         logger.error(f"An error occurred: {error}")
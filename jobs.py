@@ -0,0 +1,247 @@
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from datetime import datetime, timedelta
+from db import db
+from models import Job
+import multiprocessing
+import threading
+import socket
+import time
+import uuid
+import os
+import logging
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+ACTIVE = (QUEUED, RUNNING)
+
+class JobLimitExceeded(Exception):
+    pass
+
+class JobQueue:
+    """
+    Runs slow work (Gmail fetches, spaCy, LLM calls) outside the request thread.
+
+    Job state is persisted in the jobs table so any worker can answer status
+    requests. The work itself runs on a thread or process pool. Job functions
+    must not touch the database, because with the process backend they run
+    in another process. Database writes belong in on_done, which always runs
+    in this process inside an app context.
+
+    Several server processes can share the jobs table. Each job records the
+    process that runs it, and that process refreshes updated_at on its
+    active jobs every heartbeat_interval seconds. Active jobs whose worker
+    has missed several heartbeats, or whose worker is a previous run of this
+    process, can never finish and are marked failed.
+
+    Args:
+        app: Flask application, used to push an app context for status updates.
+        backend (str): "thread" or "process".
+        max_workers (int): Maximum jobs running at once on this backend.
+        per_user_limit (int): Maximum queued or running jobs per user.
+        kind_limits (dict): Kinds of background work with their own per-user
+                            limit, e.g. {"prefetch": 1}. They are not counted
+                            against per_user_limit, so they cannot block jobs
+                            the user is waiting on.
+        heartbeat_interval (float): Seconds between heartbeats.
+    """
+    def __init__(self, app, backend="thread", max_workers=4, per_user_limit=2, kind_limits=None, heartbeat_interval=30):
+        self.app = app
+        self.backend = backend
+        self.max_workers = max_workers
+        self.per_user_limit = per_user_limit
+        self.kind_limits = kind_limits or {}
+        self.heartbeat_interval = heartbeat_interval
+        # A restarted container usually gets the same hostname and pid back
+        self.worker = f"{socket.gethostname()}:{os.getpid()}"
+        self._lock = threading.Lock()
+        # Futures of this process's unfinished jobs, so replaced ones can be cancelled
+        self._futures = {}
+        if backend == "process":
+            # Forked workers would inherit the LLM gateway without the thread
+            # running its event loop, and the cached Gmail connections, so
+            # they are started fresh instead
+            self.executor = ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context("spawn"))
+        elif backend == "thread":
+            self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+        else:
+            raise ValueError(f"Unknown job backend: {backend}")
+
+        # Work from a previous run cannot be resumed, since the queue only holds
+        # closures in memory. Jobs of other live processes are left alone.
+        with app.app_context():
+            db.session.execute(
+                db.update(Job)
+                .where(Job.worker == self.worker, Job.status.in_(ACTIVE))
+                .values(status=FAILED, error="Interrupted by server restart", updated_at=datetime.utcnow())
+            )
+            db.session.commit()
+            self._fail_stale_jobs()
+
+        self._heartbeat = threading.Thread(target=self._heartbeat_loop, name="job-heartbeat", daemon=True)
+        self._heartbeat.start()
+
+    def _fail_stale_jobs(self):
+        # Three missed heartbeats, so a slow commit is not mistaken for a dead worker
+        cutoff = datetime.utcnow() - timedelta(seconds=3 * self.heartbeat_interval)
+        stale = db.session.execute(
+            db.update(Job)
+            .where(Job.status.in_(ACTIVE), Job.updated_at < cutoff)
+            .values(status=FAILED, error="Interrupted: the worker running it stopped", updated_at=datetime.utcnow())
+        ).rowcount
+        db.session.commit()
+        if stale:
+            logger.warning(f"Marked {stale} jobs of stopped workers as failed")
+
+    def _heartbeat_loop(self):
+        while True:
+            time.sleep(self.heartbeat_interval)
+            try:
+                with self.app.app_context():
+                    db.session.execute(
+                        db.update(Job)
+                        .where(Job.worker == self.worker, Job.status.in_(ACTIVE))
+                        .values(updated_at=datetime.utcnow())
+                    )
+                    db.session.commit()
+                    self._fail_stale_jobs()
+            except Exception as error:
+                logger.error(f"Job heartbeat failed: {error}")
+
+    def submit(self, user_email, kind, fn, *args, on_done=None, then=None, replace=False):
+        """
+        Queues fn(*args) and returns the new job ID.
+
+        Args:
+            user_email (str): Owner of the job.
+            kind (str): Name of the job type, e.g. "style".
+            fn (callable): Work to run. Must be picklable for the process backend.
+            on_done (callable): Optional on_done(result) run in an app context
+                                after fn succeeds. Its return value replaces the stored result.
+            then (callable): Optional then(result) run in an app context once the
+                             job is marked done, when it no longer counts as
+                             active. Used to queue follow-up jobs.
+            replace (bool): Give up the user's active jobs of the same kind
+                            first, e.g. a reply still being prepared for a
+                            thread the user has left. Queued ones are
+                            cancelled, and none of them count against the
+                            limit any more.
+
+        Raises:
+            JobLimitExceeded: If the user already has as many active jobs as
+                              the limit that applies to this kind.
+        """
+        job_id = uuid.uuid4().hex
+        now = datetime.utcnow()
+        if kind in self.kind_limits:
+            limit = self.kind_limits[kind]
+            same_limit = Job.kind == kind
+        else:
+            limit = self.per_user_limit
+            same_limit = Job.kind.not_in(list(self.kind_limits))
+        with self._lock:
+            if replace:
+                self._replace_active(user_email, kind)
+            active = db.session.execute(db.select(db.func.count(Job.id)).where(Job.user_email == user_email, Job.status.in_(ACTIVE), same_limit)).scalar()
+            if active >= limit:
+                raise JobLimitExceeded(f"{user_email} already has {active} active jobs of this kind")
+            db.session.add(Job(id=job_id, user_email=user_email, kind=kind, status=QUEUED, worker=self.worker, created_at=now, updated_at=now))
+            db.session.commit()
+
+        if self.backend == "thread":
+            future = self.executor.submit(self._run_in_context, job_id, fn, args)
+        else:
+            self._set_status(job_id, RUNNING)
+            future = self.executor.submit(fn, *args)
+        self._futures[job_id] = future
+        future.add_done_callback(lambda f: self._finish(job_id, f, on_done, then))
+        logger.info(f"Queued {kind} job {job_id}")
+        return job_id
+
+    def _replace_active(self, user_email, kind):
+        replaced = db.session.execute(db.select(Job.id).where(Job.user_email == user_email, Job.kind == kind, Job.status.in_(ACTIVE))).scalars().all()
+        for job_id in replaced:
+            future = self._futures.get(job_id)
+            # Jobs already running finish in the background, but no longer hold a slot
+            if future is not None:
+                future.cancel()
+        if replaced:
+            db.session.execute(
+                db.update(Job)
+                .where(Job.id.in_(replaced))
+                .values(status=FAILED, error="Replaced by a newer request", updated_at=datetime.utcnow())
+            )
+            db.session.commit()
+            logger.info(f"Replaced {len(replaced)} active {kind} jobs")
+
+    def _run_in_context(self, job_id, fn, args):
+        with self.app.app_context():
+            # A job replaced while it waited for a worker is not started
+            started = db.session.execute(
+                db.update(Job).where(Job.id == job_id, Job.status == QUEUED).values(status=RUNNING, updated_at=datetime.utcnow())
+            ).rowcount
+            db.session.commit()
+        if not started:
+            raise RuntimeError("Replaced by a newer request")
+        return fn(*args)
+
+    def _set_status(self, job_id, status, result=None, error=None):
+        job = db.session.get(Job, job_id)
+        job.status = status
+        job.result = result
+        job.error = error
+        job.updated_at = datetime.utcnow()
+        db.session.commit()
+
+    def _finish(self, job_id, future, on_done, then=None):
+        self._futures.pop(job_id, None)
+        if future.cancelled():
+            return
+        with self.app.app_context():
+            try:
+                result = future.result()
+                if on_done is not None:
+                    result = on_done(result)
+                self._set_status(job_id, DONE, result=result)
+                logger.info(f"Job {job_id} finished")
+            except Exception as error:
+                logger.error(f"Job {job_id} failed: {error}")
+                db.session.rollback()
+                self._set_status(job_id, FAILED, error=str(error))
+                return
+            if then is not None:
+                try:
+                    then(result)
+                except Exception as error:
+                    logger.error(f"Follow-up of job {job_id} failed: {error}")
+
+    def has_active(self, user_email, kind):
+        """
+        Returns True if the user already has a queued or running job of this kind.
+        """
+        active = db.session.execute(db.select(db.func.count(Job.id)).where(Job.user_email == user_email, Job.kind == kind, Job.status.in_(ACTIVE))).scalar()
+        return active > 0
+
+    def get(self, job_id, user_email):
+        """
+        Returns the job if it exists and belongs to user_email, otherwise None.
+        """
+        job = db.session.get(Job, job_id)
+        if job is None or job.user_email != user_email:
+            return None
+        return job
+
+def init_app(app):
+    return JobQueue(
+        app,
+        backend=os.environ.get("JOB_BACKEND", "thread"),
+        max_workers=int(os.environ.get("JOB_WORKERS", "4")),
+        per_user_limit=int(os.environ.get("JOB_USER_LIMIT", "2")),
+        # Speculative and index maintenance work, one of each per user at a time
+        kind_limits={"prefetch": 1, "index": 1, "backfill": 1, "exemplars": 1},
+        heartbeat_interval=float(os.environ.get("JOB_HEARTBEAT_SECONDS", "30")),
+    )
@@ -0,0 +1,106 @@
+import sqlite3
+import hashlib
+import json
+import threading
+import time
+import os
+import logging
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+class LLMCache:
+    """
+    On-disk cache of LLM completions keyed by model, messages and sampling
+    parameters.
+
+    It uses its own SQLite file instead of the Flask-SQLAlchemy session,
+    because LLM calls also run in background jobs outside an app context and
+    possibly in another process.
+
+    Args:
+        path (str): SQLite file to store entries in.
+        ttl (float): Seconds an entry stays valid.
+        max_entries (int): Least recently used entries beyond this are evicted.
+    """
+    def __init__(self, path, ttl=7 * 24 * 3600, max_entries=5000):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.latency_saved = 0.0
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with self._connect() as connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS llm_cache ("
+                "key TEXT PRIMARY KEY, content TEXT NOT NULL, latency REAL NOT NULL, "
+                "created_at REAL NOT NULL, last_used REAL NOT NULL)"
+            )
+            connection.execute("CREATE INDEX IF NOT EXISTS ix_llm_cache_last_used ON llm_cache (last_used)")
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=10)
+
+    @staticmethod
+    def key_for(request):
+        """
+        Hashes everything that influences the completion: model, messages and
+        sampling parameters.
+        """
+        return hashlib.sha256(json.dumps(request, sort_keys=True).encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        """
+        Returns the cached content for key, or None on a miss.
+        """
+        now = time.time()
+        with self._connect() as connection:
+            row = connection.execute("SELECT content, latency, created_at FROM llm_cache WHERE key = ?", (key,)).fetchone()
+            if row is not None and now - row[2] > self.ttl:
+                connection.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+                row = None
+            if row is not None:
+                connection.execute("UPDATE llm_cache SET last_used = ? WHERE key = ?", (now, key))
+        with self._lock:
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.latency_saved += row[1]
+        return row[0]
+
+    def put(self, key, content, latency):
+        """
+        Stores content for key, remembering how long the call took so hits can
+        report the latency they saved.
+        """
+        now = time.time()
+        with self._connect() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, content, latency, created_at, last_used) VALUES (?, ?, ?, ?, ?)",
+                (key, content, latency, now, now)
+            )
+            connection.execute(
+                "DELETE FROM llm_cache WHERE key IN ("
+                "SELECT key FROM llm_cache ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,)
+            )
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'latency_saved': self.latency_saved,
+            }
+
+def create_cache():
+    return LLMCache(
+        os.environ.get("LLM_CACHE_PATH", os.path.join("instance", "llm_cache.db")),
+        ttl=float(os.environ.get("LLM_CACHE_TTL", 7 * 24 * 3600)),
+        max_entries=int(os.environ.get("LLM_CACHE_MAX_ENTRIES", "5000")),
+    )
@@ -0,0 +1,182 @@
+import asyncio
+import bisect
+import random
+import threading
+import time
+import os
+import logging
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+LATENCY_BUCKETS = [0.1, 0.25, 0.5, 1, 2, 5, 10, 30, 60]
+
+class TokenBucket:
+    """
+    Token bucket refilled continuously at capacity per minute. Callers wait
+    until enough tokens are available instead of failing.
+    """
+    def __init__(self, per_minute, clock=time.monotonic, sleep=asyncio.sleep):
+        self.capacity = per_minute
+        self.tokens = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.clock = clock
+        self.sleep = sleep
+        self.updated = clock()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = self.clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, amount=1):
+        # Requests larger than the bucket are let through once it is full
+        amount = min(amount, self.capacity)
+        async with self._lock:
+            self._refill()
+            while self.tokens < amount:
+                await self.sleep((amount - self.tokens) / self.rate)
+                self._refill()
+            self.tokens -= amount
+
+def estimate_tokens(messages, max_tokens=None):
+    """
+    Rough token count of a request: about four characters per token for the
+    prompt, plus the completion budget.
+    """
+    prompt_chars = sum(len(message["content"]) for message in messages)
+    return prompt_chars // 4 + (max_tokens or 0)
+
+class LLMGateway:
+    """
+    Schedules chat completion requests on an asyncio event loop running in a
+    background thread.
+
+    At most max_concurrency requests are in flight at once. Requests per
+    minute and tokens per minute are limited with token buckets. Failures
+    with status 429 or 5xx are retried with jittered exponential backoff.
+    Bursts queue up instead of surfacing errors to the caller.
+
+    Args:
+        send (coroutine function): Performs one request, e.g. AsyncGroq().chat.completions.create.
+        max_concurrency (int): Maximum requests in flight.
+        requests_per_minute (int): Request rate limit.
+        tokens_per_minute (int): Token rate limit, using estimate_tokens.
+        max_retries (int): Retries for retryable failures.
+        base_delay (float): First backoff delay in seconds.
+        clock (callable): Returns the current time in seconds, for the rate
+                          limits and latencies. Defaults to time.monotonic.
+        rng (random.Random): Source of the backoff jitter. Defaults to a new
+                             unseeded random.Random.
+        sleep (coroutine function): Waits for a number of seconds, for
+                                    backoff and rate limiting. Defaults to
+                                    asyncio.sleep.
+
+    Passing a fake clock and sleep and a seeded rng makes the scheduling
+    deterministic in tests.
+    """
+    def __init__(self, send, max_concurrency=4, requests_per_minute=30, tokens_per_minute=30000, max_retries=5, base_delay=1.0,
+                 clock=time.monotonic, rng=None, sleep=asyncio.sleep):
+        self.send = send
+        self.max_concurrency = max_concurrency
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.clock = clock
+        self.rng = rng or random.Random()
+        self.sleep = sleep
+
+        self.queue_depth = 0
+        self.in_flight = 0
+        self.retries = 0
+        self.latency_histogram = [0] * (len(LATENCY_BUCKETS) + 1)
+        self._stats_lock = threading.Lock()
+
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self.loop.run_forever, name="llm-gateway", daemon=True)
+        self._thread.start()
+        # Loop-bound primitives have to be created on the loop's thread
+        asyncio.run_coroutine_threadsafe(self._setup(), self.loop).result()
+
+    async def _setup(self):
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        self._requests = TokenBucket(self.requests_per_minute, clock=self.clock, sleep=self.sleep)
+        self._tokens = TokenBucket(self.tokens_per_minute, clock=self.clock, sleep=self.sleep)
+
+    async def acomplete(self, **kwargs):
+        """
+        Sends a chat completion request through the scheduler and returns the response.
+        """
+        start = self.clock()
+        dequeued = False
+        with self._stats_lock:
+            self.queue_depth += 1
+        try:
+            await self._requests.acquire()
+            await self._tokens.acquire(estimate_tokens(kwargs["messages"], kwargs.get("max_tokens")))
+            async with self._semaphore:
+                with self._stats_lock:
+                    self.queue_depth -= 1
+                    self.in_flight += 1
+                dequeued = True
+                try:
+                    return await self._send_with_retries(kwargs)
+                finally:
+                    with self._stats_lock:
+                        self.in_flight -= 1
+        finally:
+            elapsed = self.clock() - start
+            with self._stats_lock:
+                if not dequeued:
+                    self.queue_depth -= 1
+                self.latency_histogram[bisect.bisect_left(LATENCY_BUCKETS, elapsed)] += 1
+
+    async def _send_with_retries(self, kwargs):
+        for attempt in range(self.max_retries + 1):
+            try:
+                return await self.send(**kwargs)
+            except Exception as error:
+                status = getattr(error, "status_code", None)
+                if status not in RETRYABLE_STATUS or attempt == self.max_retries:
+                    raise
+                delay = self.base_delay * (2 ** attempt)
+                delay = self.rng.uniform(delay / 2, delay)
+                with self._stats_lock:
+                    self.retries += 1
+                logger.warning(f"LLM request failed with status {status}, retrying in {delay:.2f}s")
+                await self.sleep(delay)
+
+    def complete(self, **kwargs):
+        """
+        Blocking wrapper around acomplete for use from Flask request threads and jobs.
+        """
+        return asyncio.run_coroutine_threadsafe(self.acomplete(**kwargs), self.loop).result()
+
+    def stats(self):
+        with self._stats_lock:
+            return {
+                'queue_depth': self.queue_depth,
+                'in_flight': self.in_flight,
+                'retries': self.retries,
+                'latency_histogram': dict(zip([str(b) for b in LATENCY_BUCKETS] + ['inf'], self.latency_histogram)),
+            }
+
+def create_gateway():
+    """
+    Builds the gateway for the configured LLM client.
+    """
+    if os.environ.get("USE_FAKE_LLM", "false").lower() == "true":
+        from fake_llm import FakeAsyncClient
+        client = FakeAsyncClient(latency=float(os.environ.get("FAKE_LLM_LATENCY", "0")))
+    else:
+        from groq import AsyncGroq
+        client = AsyncGroq(api_key=os.environ.get("GROQ_API_KEY"))
+    return LLMGateway(
+        client.chat.completions.create,
+        max_concurrency=int(os.environ.get("LLM_MAX_CONCURRENCY", "4")),
+        requests_per_minute=int(os.environ.get("LLM_REQUESTS_PER_MINUTE", "30")),
+        tokens_per_minute=int(os.environ.get("LLM_TOKENS_PER_MINUTE", "30000")),
+    )
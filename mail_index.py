@@ -0,0 +1,218 @@
+from db import db
+from datetime import datetime, timedelta
+import hashlib
+import re
+import logging
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# How long an index is trusted before a background sync is queued
+STALE_AFTER = timedelta(minutes=15)
+PAGE_SIZE = 10
+
+def init_app(app):
+    """
+    Creates the full-text index tables. FTS5 virtual tables cannot be declared
+    as models, so they are created with plain SQL.
+
+    Documents live in the ordinary mail_index_docs table, which has real
+    indexes on (user_email, message_id) and (user_email, date). The FTS5
+    table mail_index_fts uses it as external content keyed by rowid, and
+    triggers keep the two in sync.
+    """
+    with app.app_context():
+        db.session.execute(db.text(
+            "CREATE TABLE IF NOT EXISTS mail_index_docs ("
+            "id INTEGER PRIMARY KEY, user_email VARCHAR(150) NOT NULL, owner VARCHAR(40) NOT NULL, "
+            "message_id VARCHAR(64) NOT NULL, thread_id VARCHAR(64), subject TEXT, sender TEXT, body TEXT, "
+            "snippet TEXT, date BIGINT, UNIQUE (user_email, message_id))"
+        ))
+        db.session.execute(db.text("CREATE INDEX IF NOT EXISTS ix_mail_index_docs_user_date ON mail_index_docs (user_email, date)"))
+        db.session.execute(db.text(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS mail_index_fts USING fts5("
+            "owner, subject, sender, body, content='mail_index_docs', content_rowid='id', "
+            "tokenize='porter unicode61')"
+        ))
+        db.session.execute(db.text(
+            "CREATE TRIGGER IF NOT EXISTS mail_index_docs_ai AFTER INSERT ON mail_index_docs BEGIN "
+            "INSERT INTO mail_index_fts (rowid, owner, subject, sender, body) "
+            "VALUES (new.id, new.owner, new.subject, new.sender, new.body); END"
+        ))
+        db.session.execute(db.text(
+            "CREATE TRIGGER IF NOT EXISTS mail_index_docs_ad AFTER DELETE ON mail_index_docs BEGIN "
+            "INSERT INTO mail_index_fts (mail_index_fts, rowid, owner, subject, sender, body) "
+            "VALUES ('delete', old.id, old.owner, old.subject, old.sender, old.body); END"
+        ))
+        db.session.execute(db.text(
+            "CREATE TABLE IF NOT EXISTS mail_index_state ("
+            "user_email VARCHAR(150) PRIMARY KEY, synced_at DATETIME NOT NULL, history_id VARCHAR(32), "
+            "complete BOOLEAN NOT NULL DEFAULT 0)"
+        ))
+        columns = [row[1] for row in db.session.execute(db.text("PRAGMA table_info(mail_index_state)"))]
+        if 'history_id' not in columns:
+            db.session.execute(db.text("ALTER TABLE mail_index_state ADD COLUMN history_id VARCHAR(32)"))
+        if 'complete' not in columns:
+            db.session.execute(db.text("ALTER TABLE mail_index_state ADD COLUMN complete BOOLEAN NOT NULL DEFAULT 0"))
+        db.session.commit()
+
+def owner_token(user_email):
+    """
+    Returns the token that marks a user's documents in the FTS table. It is
+    part of every MATCH, so searches only walk the user's own postings.
+    """
+    return "u" + hashlib.sha1(user_email.lower().encode('utf-8')).hexdigest()[:20]
+
+def is_stale(user_email):
+    synced_at = db.session.execute(
+        db.text("SELECT synced_at FROM mail_index_state WHERE user_email = :user_email"),
+        {"user_email": user_email}
+    ).scalar()
+    if synced_at is None:
+        return True
+    if isinstance(synced_at, str):
+        synced_at = datetime.fromisoformat(synced_at)
+    return datetime.utcnow() - synced_at > STALE_AFTER
+
+def is_complete(user_email):
+    """
+    Returns True once the index covers the whole mailbox, not just its most
+    recent mail.
+    """
+    return bool(db.session.execute(
+        db.text("SELECT complete FROM mail_index_state WHERE user_email = :user_email"),
+        {"user_email": user_email}
+    ).scalar())
+
+def get_history_id(user_email):
+    """
+    Returns the Gmail historyId the user's index was last synced to, or None.
+    """
+    return db.session.execute(
+        db.text("SELECT history_id FROM mail_index_state WHERE user_email = :user_email"),
+        {"user_email": user_email}
+    ).scalar()
+
+def get_backfill_point(user_email):
+    """
+    Returns where backfilling continues: the second of the oldest indexed
+    message and the IDs indexed within that second, or (None, []) for an
+    empty index.
+    """
+    oldest = db.session.execute(
+        db.text("SELECT MIN(date) FROM mail_index_docs WHERE user_email = :user_email"),
+        {"user_email": user_email}
+    ).scalar()
+    if oldest is None:
+        return None, []
+    # internalDate is in milliseconds, Gmail's before: takes seconds
+    second = oldest // 1000
+    ids = db.session.execute(
+        db.text("SELECT message_id FROM mail_index_docs WHERE user_email = :user_email AND date >= :start AND date < :end"),
+        {"user_email": user_email, "start": second * 1000, "end": (second + 1) * 1000}
+    ).scalars().all()
+    return second, ids
+
+def apply_sync(user_email, sync):
+    """
+    Applies the result of tasks.sync_mailbox to the user's index.
+    """
+    if sync['full']:
+        db.session.execute(db.text("DELETE FROM mail_index_docs WHERE user_email = :user_email"), {"user_email": user_email})
+    remove_messages(user_email, sync['deleted'])
+    index_messages(user_email, sync['messages'], sync['history_id'], complete=sync['complete'] if sync['full'] else None)
+    logger.info(f"{'Full' if sync['full'] else 'Incremental'} sync for {user_email}: {len(sync['messages'])} added, {len(sync['deleted'])} removed")
+
+def apply_backfill(user_email, backfill):
+    """
+    Applies the result of tasks.backfill_mailbox to the user's index.
+    """
+    index_messages(user_email, backfill['messages'], complete=backfill['complete'])
+    logger.info(f"Backfilled {len(backfill['messages'])} older messages for {user_email}, complete: {backfill['complete']}")
+
+def index_messages(user_email, messages, history_id=None, complete=None):
+    """
+    Adds or replaces messages in the user's index and marks it as synced.
+
+    Args:
+        user_email (str): Owner of the messages.
+        messages (list): Messages as returned by get_messages.parse_message.
+        history_id (str): Gmail historyId the index is now synced to, if known.
+        complete (bool): Whether the index now covers the whole mailbox, or
+                         None to leave it unchanged.
+    """
+    owner = owner_token(user_email)
+    for message in messages:
+        params = {"user_email": user_email, "message_id": message['id']}
+        db.session.execute(db.text("DELETE FROM mail_index_docs WHERE user_email = :user_email AND message_id = :message_id"), params)
+        db.session.execute(db.text(
+            "INSERT INTO mail_index_docs (user_email, owner, message_id, thread_id, subject, sender, body, snippet, date) "
+            "VALUES (:user_email, :owner, :message_id, :thread_id, :subject, :sender, :body, :snippet, :date)"
+        ), {
+            **params,
+            "owner": owner,
+            "thread_id": message['threadId'],
+            "subject": message['subject'],
+            "sender": f"{message['SenderName']} {message['SenderMail']}",
+            "body": message['body'],
+            "snippet": message.get('snippet', ''),
+            "date": message.get('date', 0),
+        })
+    db.session.execute(db.text(
+        "INSERT INTO mail_index_state (user_email, synced_at, history_id, complete) "
+        "VALUES (:user_email, :synced_at, :history_id, COALESCE(:complete, 0)) "
+        "ON CONFLICT(user_email) DO UPDATE SET synced_at = excluded.synced_at, "
+        "history_id = COALESCE(:history_id, mail_index_state.history_id), "
+        "complete = COALESCE(:complete, mail_index_state.complete)"
+    ), {"user_email": user_email, "synced_at": datetime.utcnow(), "history_id": history_id, "complete": complete})
+    db.session.commit()
+    logger.info(f"Indexed {len(messages)} messages for {user_email}")
+
+def remove_messages(user_email, message_ids):
+    """
+    Removes messages from the user's index.
+    """
+    for message_id in message_ids:
+        db.session.execute(
+            db.text("DELETE FROM mail_index_docs WHERE user_email = :user_email AND message_id = :message_id"),
+            {"user_email": user_email, "message_id": message_id}
+        )
+    db.session.commit()
+
+def to_match_query(text):
+    """
+    Turns free text into an FTS5 query where every word is a prefix match, so
+    partially typed words still find results and user input cannot break the
+    query syntax.
+    """
+    terms = re.findall(r"\w+", text)
+    return " ".join(f'"{term}"*' for term in terms)
+
+def search(user_email, text, page=1, page_size=PAGE_SIZE):
+    """
+    Searches the user's indexed mail, ranking subject matches above sender
+    and body matches.
+
+    Returns:
+        list: Results with the same keys as get_messages.get_messages.
+    """
+    query = to_match_query(text)
+    if not query:
+        return []
+    rows = db.session.execute(db.text(
+        "SELECT docs.message_id, docs.thread_id, docs.subject, docs.snippet "
+        "FROM mail_index_fts JOIN mail_index_docs AS docs ON docs.id = mail_index_fts.rowid "
+        "WHERE mail_index_fts MATCH :query "
+        # bm25 takes one weight per column, in declaration order
+        "ORDER BY bm25(mail_index_fts, 0, 10.0, 3.0, 1.0) "
+        "LIMIT :limit OFFSET :offset"
+    ), {
+        # The owner token restricts the match to this user's documents
+        "query": f'owner:"{owner_token(user_email)}" AND ({query})',
+        "limit": page_size,
+        "offset": (max(1, page) - 1) * page_size,
+    }).all()
+    return [
+        {'id': message_id, 'threadId': thread_id, 'subject': subject, 'body': snippet}
+        for message_id, thread_id, subject, snippet in rows
+    ]
@@ -0,0 +1,50 @@
+from db import db
+from models import Message
+import logging
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+def save_messages(user_id, messages):
+    """
+    Stores messages for a user. Messages are keyed by their Gmail ID, so a
+    message that is already stored is updated instead of duplicated.
+
+    Args:
+        user_id (int): Owner of the messages.
+        messages (list): Messages as returned by get_messages.parse_message.
+    """
+    for message in messages:
+        db.session.merge(Message(
+            user_id=user_id,
+            id=message['id'],
+            thread_id=message['threadId'],
+            sender_name=message['SenderName'],
+            sender_mail=message['SenderMail'],
+            subject=message['subject'],
+            body=message['body'],
+            snippet=message.get('snippet', ''),
+            date=message.get('date', 0)
+        ))
+    db.session.commit()
+
+def stored_ids(user_id, message_ids):
+    """
+    Returns the subset of message_ids that is already stored for the user.
+    """
+    if not message_ids:
+        return set()
+    rows = db.session.execute(db.select(Message.id).where(Message.user_id == user_id, Message.id.in_(message_ids)))
+    return set(rows.scalars())
+
+def load_thread(user_id, thread_id):
+    """
+    Returns the stored messages of a thread, oldest first, in the format of
+    get_messages.get_thread.
+    """
+    if thread_id is None:
+        return []
+    rows = db.session.execute(
+        db.select(Message).where(Message.user_id == user_id, Message.thread_id == thread_id).order_by(Message.date)
+    ).scalars()
+    return [message.to_dict() for message in rows]
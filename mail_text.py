@@ -0,0 +1,164 @@
+from html.parser import HTMLParser
+import re
+
+# Tags that end a line of text when rendered
+BLOCK_TAGS = {'br', 'p', 'div', 'tr', 'li', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'table', 'hr'}
+# Tags whose content is never part of the message text
+SKIPPED_TAGS = {'script', 'style', 'head', 'title', 'blockquote'}
+# Gmail and Outlook wrap quoted history and signatures in elements with these classes
+SKIPPED_CLASSES = {'gmail_quote', 'gmail_signature', 'gmail_extra', 'moz-cite-prefix', 'yahoo_quoted'}
+VOID_TAGS = {'br', 'hr', 'img', 'meta', 'link', 'input', 'wbr', 'col', 'area', 'base', 'source'}
+# Gmail puts forwarded mail in a gmail_quote too, but that is the content to reply to
+FORWARD_HEADER = re.compile(r"^-{2,}\s*Forwarded message\s*-{2,}", re.IGNORECASE)
+
+class _SkippedElement:
+    def __init__(self, tag, keep_forward):
+        self.tag = tag
+        # Nesting depth of tags with the same name, the only ones that can close it
+        self.depth = 1
+        self.keep_forward = keep_forward
+        self.parts = []
+
+class _TextExtractor(HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts = []
+        self.skipped = []
+
+    def _output(self):
+        return self.skipped[-1].parts if self.skipped else self.parts
+
+    def handle_starttag(self, tag, attrs):
+        if tag in VOID_TAGS:
+            if tag in BLOCK_TAGS:
+                self._output().append("\n")
+            return
+        classes = set((dict(attrs).get('class') or '').split())
+        if tag in SKIPPED_TAGS or classes & SKIPPED_CLASSES:
+            self.skipped.append(_SkippedElement(tag, keep_forward='gmail_quote' in classes))
+            return
+        if self.skipped and tag == self.skipped[-1].tag:
+            self.skipped[-1].depth += 1
+        if tag in BLOCK_TAGS:
+            self._output().append("\n")
+
+    def handle_endtag(self, tag):
+        if tag in VOID_TAGS:
+            return
+        if self.skipped and tag == self.skipped[-1].tag:
+            element = self.skipped[-1]
+            element.depth -= 1
+            if element.depth == 0:
+                self.skipped.pop()
+                if element.keep_forward and FORWARD_HEADER.match("".join(element.parts).strip()):
+                    self._output().extend(element.parts)
+        elif tag in BLOCK_TAGS:
+            self._output().append("\n")
+
+    def handle_data(self, data):
+        self._output().append(data)
+
+def html_to_text(html):
+    """
+    Converts an HTML mail body to plain text, dropping markup, scripts,
+    styles and quoted history.
+    """
+    parser = _TextExtractor()
+    parser.feed(html)
+    parser.close()
+    text = "".join(parser.parts)
+    text = re.sub(r"[ \t\r\f\v]+", " ", text)
+    return re.sub(r"\n\s*\n+", "\n\n", text).strip()
+
+# Lines that introduce the quoted previous message in replies. Forwarded
+# messages are kept, since they are what the sender wants a reply about.
+QUOTE_HEADER = re.compile(
+    r"^(On .+wrote:|-{2,}\s*Original Message\s*-{2,})$",
+    re.IGNORECASE
+)
+# Gmail wraps long attributions over lines, e.g. "On Mon, ... Alice <a@x.com>"
+# then "wrote:". The address tells them apart from prose ending in "wrote:".
+WRAPPED_QUOTE_HEADER = re.compile(r"^On .+<[^<>\s]+@[^<>\s]+>.*wrote:$", re.IGNORECASE)
+# Lines an attribution is wrapped over at most
+MAX_ATTRIBUTION_LINES = 3
+# Header lines Gmail puts under a forwarded message marker
+FORWARDED_FIELD = re.compile(r"^(From|Date|Sent|Subject|To|Cc):", re.IGNORECASE)
+# Outlook introduces quoted history with a From:/Sent: header block
+OUTLOOK_HEADER = re.compile(r"^From:\s.+", re.IGNORECASE)
+OUTLOOK_SENT = re.compile(r"^(Sent|Date):\s.+", re.IGNORECASE)
+# The standard "-- " signature delimiter
+SIGNATURE_DELIMITER = re.compile(r"^--\s?$")
+# Paragraphs shorter than this, like greetings and sign-offs, may repeat
+# legitimately and are never treated as duplicates
+MIN_REPEATED_CHARS = 30
+
+def is_wrapped_attribution(lines):
+    """
+    Returns True if lines start with a quote attribution wrapped over
+    several lines.
+    """
+    joined = lines[0].strip()
+    for line in lines[1:]:
+        joined += " " + line.strip()
+        if line.strip().lower().endswith("wrote:"):
+            return bool(WRAPPED_QUOTE_HEADER.match(joined))
+    return False
+
+def strip_quoted(text):
+    """
+    Removes quoted replies and the signature from a plain text body, keeping
+    only what the sender wrote in this message. Forwarded messages are kept.
+    """
+    lines = []
+    text_lines = text.splitlines()
+    in_forward_header = False
+    for index, line in enumerate(text_lines):
+        stripped = line.strip()
+        if FORWARD_HEADER.match(stripped):
+            in_forward_header = True
+            lines.append(line)
+            continue
+        if in_forward_header and FORWARDED_FIELD.match(stripped):
+            lines.append(line)
+            continue
+        in_forward_header = False
+        if QUOTE_HEADER.match(stripped) or SIGNATURE_DELIMITER.match(line.rstrip("\r")):
+            break
+        if stripped.startswith("On ") and is_wrapped_attribution(text_lines[index:index + MAX_ATTRIBUTION_LINES]):
+            break
+        if OUTLOOK_HEADER.match(stripped) and index + 1 < len(text_lines) and OUTLOOK_SENT.match(text_lines[index + 1].strip()):
+            break
+        if stripped.startswith(">"):
+            continue
+        lines.append(line)
+    return "\n".join(lines).strip()
+
+def compact_thread(bodies):
+    """
+    Removes text that repeats across a thread: quoted history, and paragraphs
+    already seen in an earlier message such as recurring signatures and
+    disclaimers. The first occurrence of each paragraph is kept, so every
+    message keeps its new content.
+
+    Args:
+        bodies (list): Message bodies, oldest first.
+
+    Returns:
+        list: The compacted bodies, in the same order.
+    """
+    seen = set()
+    compacted = []
+    for body in bodies:
+        kept = []
+        for paragraph in re.split(r"\n\s*\n", strip_quoted(body)):
+            # Compare ignoring case and line wrapping, which quoting often changes
+            key = " ".join(paragraph.split()).lower()
+            if not key:
+                continue
+            if len(key) >= MIN_REPEATED_CHARS:
+                if key in seen:
+                    continue
+                seen.add(key)
+            kept.append(paragraph.strip())
+        compacted.append("\n\n".join(kept))
+    return compacted
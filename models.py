@@ -8,5 +8,83 @@ class User(db.Model):
     email = db.Column(db.String(150), unique=True, nullable=False)
     password = db.Column(db.String(150), nullable=False)
     credentials = db.Column(db.String(500))
-    writingStyle = db.Column(db.String(1000))
-    mails = db.Column(db.JSON)
\ No newline at end of file
+    currentThread = db.Column(db.String(64))
+    # Every processed message ID and the full vocabulary, so it grows with
+    # the mailbox. Deferred so it is only loaded by the style analysis.
+    styleProfile = db.deferred(db.Column(db.JSON))
+    # StyleAnalyzer features packed as float32, see agent.pack_style_vector
+    styleVector = db.Column(db.LargeBinary)
+    styleSummary = db.Column(db.String(300))
+    messages = db.relationship('Message', lazy='dynamic', back_populates='user')
+
+class SummaryCache(db.Model):
+    __tablename__ = 'summary_cache'
+
+    key = db.Column(db.String(64), primary_key=True)
+    summary = db.Column(db.Text, nullable=False)
+    size = db.Column(db.Integer, nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False)
+    last_used = db.Column(db.DateTime, nullable=False, index=True)
+
+class Job(db.Model):
+    __tablename__ = 'jobs'
+
+    id = db.Column(db.String(32), primary_key=True)
+    user_email = db.Column(db.String(150), nullable=False, index=True)
+    kind = db.Column(db.String(50), nullable=False)
+    status = db.Column(db.String(20), nullable=False, index=True)
+    result = db.Column(db.JSON)
+    error = db.Column(db.Text)
+    # hostname:pid of the process running the job, see jobs.JobQueue
+    worker = db.Column(db.String(300))
+    created_at = db.Column(db.DateTime, nullable=False)
+    # Refreshed by the worker's heartbeat while the job is active
+    updated_at = db.Column(db.DateTime, nullable=False)
+
+class Message(db.Model):
+    __tablename__ = 'messages'
+    __table_args__ = (
+        db.Index('ix_messages_user_thread_date', 'user_id', 'thread_id', 'date'),
+        db.Index('ix_messages_user_date', 'user_id', 'date'),
+    )
+
+    # Gmail message IDs are only unique within a mailbox
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), primary_key=True)
+    id = db.Column(db.String(64), primary_key=True)
+    thread_id = db.Column(db.String(64), nullable=False)
+    sender_name = db.Column(db.String(300))
+    sender_mail = db.Column(db.String(300))
+    subject = db.Column(db.Text)
+    body = db.Column(db.Text)
+    snippet = db.Column(db.Text)
+    date = db.Column(db.BigInteger)
+
+    user = db.relationship('User', back_populates='messages')
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'SenderName': self.sender_name,
+            'SenderMail': self.sender_mail,
+            'threadId': self.thread_id,
+            'subject': self.subject,
+            'body': self.body,
+            'snippet': self.snippet,
+            'date': self.date
+        }
+
+class StyleExemplar(db.Model):
+    __tablename__ = 'style_exemplars'
+
+    # Sent messages with their own style vectors, see style_index
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), primary_key=True)
+    message_id = db.Column(db.String(64), primary_key=True)
+    body = db.Column(db.Text, nullable=False)
+    vector = db.Column(db.LargeBinary, nullable=False)
+
+class SessionRecord(db.Model):
+    __tablename__ = 'sessions'
+
+    id = db.Column(db.String(64), primary_key=True)
+    data = db.Column(db.JSON, nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
@@ -0,0 +1,73 @@
+from concurrent.futures import ProcessPoolExecutor
+import bcrypt
+import threading
+import os
+import logging
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# bcrypt work factor for new hashes. Existing hashes with a different cost are
+# rehashed on the next successful login.
+ROUNDS = int(os.environ.get("BCRYPT_ROUNDS", "12"))
+WORKERS = int(os.environ.get("BCRYPT_WORKERS", str(os.cpu_count() or 1)))
+
+_pool = None
+_pool_lock = threading.Lock()
+# Hash checked for unknown accounts, created on first use at the current cost
+_dummy_hash = None
+_dummy_lock = threading.Lock()
+
+def _get_pool():
+    # Created on first use so worker processes are not forked at import time
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ProcessPoolExecutor(max_workers=WORKERS)
+    return _pool
+
+def _hash(password, rounds):
+    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds=rounds)).decode('utf-8')
+
+def _verify(password, hashed, rounds):
+    if not bcrypt.checkpw(password.encode('utf-8'), hashed.encode('utf-8')):
+        return False, None
+    if cost_of(hashed) != rounds:
+        return True, _hash(password, rounds)
+    return True, None
+
+def cost_of(hashed):
+    """Returns the work factor of a bcrypt hash such as $2b$12$..."""
+    return int(hashed.split("$")[2])
+
+def hash_password(password):
+    """
+    Hashes a password on the bcrypt process pool.
+    """
+    return _get_pool().submit(_hash, password, ROUNDS).result()
+
+def verify_password(password, hashed):
+    """
+    Checks a password against its stored hash on the bcrypt process pool.
+    The pool is bounded, so a burst of logins queues instead of starving the
+    threads serving other routes.
+
+    Args:
+        password (str): The password entered.
+        hashed (str): The stored hash, or None if the account does not exist.
+                      The password is then checked against a dummy hash, so
+                      response times do not reveal which accounts exist.
+
+    Returns:
+        tuple: (True if the password matches, a new hash if the stored one
+               uses a different work factor and should be replaced, else None)
+    """
+    global _dummy_hash
+    if hashed is None:
+        with _dummy_lock:
+            if _dummy_hash is None:
+                _dummy_hash = hash_password("not a password")
+        _get_pool().submit(_verify, password, _dummy_hash, ROUNDS).result()
+        return False, None
+    return _get_pool().submit(_verify, password, hashed, ROUNDS).result()
@@ -0,0 +1,126 @@
+from googleapiclient.discovery import build
+from google_auth_httplib2 import AuthorizedHttp
+import httplib2
+from collections import OrderedDict
+from contextlib import contextmanager
+import hashlib
+import threading
+import time
+import logging
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+class CountingHttp(httplib2.Http):
+    """
+    httplib2 transport that records how many bytes each service sends and
+    receives, so payload sizes of Gmail calls can be measured.
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.requests = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+
+    def request(self, uri, method="GET", body=None, headers=None, *args, **kwargs):
+        response, content = super().request(uri, method, body, headers, *args, **kwargs)
+        self.requests += 1
+        self.bytes_sent += len(body or b"")
+        self.bytes_received += len(content or b"")
+        return response, content
+
+def build_service(creds):
+    """
+    Builds a Gmail service whose transport counts bytes. The counter is
+    available as service.transfer.
+    """
+    transfer = CountingHttp()
+    service = build('gmail', 'v1', http=AuthorizedHttp(creds, http=transfer))
+    service.transfer = transfer
+    return service
+
+class ServiceCache:
+    """
+    LRU cache of Gmail service objects keyed by credential identity.
+
+    Building a service re-parses the discovery document and creates a new
+    HTTP transport, so reusing one per user avoids that cost on every request.
+    The underlying httplib2 transport is not thread safe, so each service is
+    handed out through lease(), which serializes use of a single service.
+    Background jobs lease a second service per user, so long mailbox walks
+    never make interactive requests wait for the transport.
+    """
+    def __init__(self, max_size=128, ttl=1800):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._services = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key_for(creds):
+        """
+        Returns a stable key for a set of credentials. The refresh token
+        identifies the user across access token refreshes.
+        """
+        identity = f"{creds.client_id}:{creds.refresh_token or creds.token}"
+        return hashlib.sha256(identity.encode('utf-8')).hexdigest()
+
+    def _get_entry(self, creds, background=False):
+        key = self.key_for(creds) + (":background" if background else "")
+        now = time.monotonic()
+        with self._lock:
+            entry = self._services.get(key)
+            if entry is not None and now - entry[1] < self.ttl:
+                self._services.move_to_end(key)
+                self.hits += 1
+                return entry
+            self.misses += 1
+
+        entry = (build_service(creds), now, threading.Lock())
+
+        with self._lock:
+            self._services[key] = entry
+            self._services.move_to_end(key)
+            while len(self._services) > self.max_size:
+                self._services.popitem(last=False)
+        return entry
+
+    @contextmanager
+    def lease(self, creds, background=False):
+        """
+        Yields the cached service for creds, building it on a miss. Concurrent
+        requests for the same user wait for each other instead of sharing the
+        transport.
+
+        Args:
+            background (bool): Lease the user's service for background jobs,
+                               which is separate from the interactive one.
+        """
+        service, _, lock = self._get_entry(creds, background)
+        with lock:
+            yield service
+
+    def invalidate(self, creds):
+        key = self.key_for(creds)
+        with self._lock:
+            for cached in (key, key + ":background"):
+                if self._services.pop(cached, None) is not None:
+                    logger.info("Invalidated cached Gmail service")
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / total if total else 0.0,
+                'size': len(self._services),
+            }
+
+services = ServiceCache()
+
+def lease_service(creds, background=False):
+    """Context manager yielding a cached Gmail service for the given credentials."""
+    return services.lease(creds, background)
@@ -0,0 +1,152 @@
+from flask.sessions import SessionInterface, SessionMixin
+from werkzeug.datastructures import CallbackDict
+from collections import OrderedDict
+from datetime import datetime
+from db import db
+from models import SessionRecord
+import copy
+import secrets
+import threading
+import os
+import logging
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+class ServerSession(CallbackDict, SessionMixin):
+    def __init__(self, initial=None, sid=None, new=False):
+        def on_update(self):
+            self.modified = True
+        super().__init__(initial, on_update)
+        self.sid = sid
+        self.new = new
+        self.modified = False
+
+class SQLiteStore:
+    """Keeps session data in the sessions table of users.db."""
+    def load(self, sid):
+        record = db.session.get(SessionRecord, sid)
+        if record is None or record.expires_at < datetime.utcnow():
+            return None
+        # A copy, so in-place changes to nested lists and dicts do not also
+        # change the row's committed value and make merge() skip the UPDATE
+        return copy.deepcopy(record.data)
+
+    def save(self, sid, data, expires_at):
+        db.session.merge(SessionRecord(id=sid, data=data, expires_at=expires_at))
+        db.session.commit()
+
+    def delete(self, sid):
+        db.session.execute(db.delete(SessionRecord).where(SessionRecord.id == sid))
+        db.session.commit()
+
+    def purge_expired(self):
+        db.session.execute(db.delete(SessionRecord).where(SessionRecord.expires_at < datetime.utcnow()))
+        db.session.commit()
+
+class MemoryStore:
+    """Keeps session data in process memory, evicting the least recently used sessions."""
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def load(self, sid):
+        with self._lock:
+            entry = self._sessions.get(sid)
+            if entry is None or entry[1] < datetime.utcnow():
+                return None
+            self._sessions.move_to_end(sid)
+            return copy.deepcopy(entry[0])
+
+    def save(self, sid, data, expires_at):
+        with self._lock:
+            self._sessions[sid] = (data, expires_at)
+            self._sessions.move_to_end(sid)
+            while len(self._sessions) > self.max_entries:
+                self._sessions.popitem(last=False)
+
+    def delete(self, sid):
+        with self._lock:
+            self._sessions.pop(sid, None)
+
+    def purge_expired(self):
+        now = datetime.utcnow()
+        with self._lock:
+            for sid in [sid for sid, (_, expires_at) in self._sessions.items() if expires_at < now]:
+                del self._sessions[sid]
+
+class ServerSessionInterface(SessionInterface):
+    """
+    Stores session data on the server. The cookie only carries an opaque,
+    random session ID, so summaries, style descriptions and Q&A state no
+    longer travel with every request.
+
+    Args:
+        store: SQLiteStore or MemoryStore.
+        purge_every (int): Number of saved sessions between purges of expired ones.
+    """
+    def __init__(self, store, purge_every=1000):
+        self.store = store
+        self.purge_every = purge_every
+        self._saves = 0
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if sid:
+            data = self.store.load(sid)
+            if data is not None:
+                return ServerSession(data, sid=sid)
+        return ServerSession(sid=secrets.token_urlsafe(32), new=True)
+
+    def regenerate(self, session):
+        """
+        Moves the session to a new random ID and forgets the old one. Called
+        on login, so an ID planted before authentication cannot be reused.
+        """
+        self.store.delete(session.sid)
+        session.clear()
+        session.sid = secrets.token_urlsafe(32)
+        session.new = True
+        session.modified = True
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+
+        if not session:
+            if session.modified:
+                self.store.delete(session.sid)
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+
+        if not session.modified and not self.should_set_cookie(app, session):
+            return
+
+        expires = self.get_expiration_time(app, session)
+        self.store.save(session.sid, dict(session), expires or datetime.utcnow() + app.permanent_session_lifetime)
+        self._saves += 1
+        if self._saves % self.purge_every == 0:
+            self.store.purge_expired()
+
+        response.set_cookie(
+            name,
+            session.sid,
+            expires=expires,
+            httponly=self.get_cookie_httponly(app),
+            domain=domain,
+            path=path,
+            secure=self.get_cookie_secure(app),
+            samesite=self.get_cookie_samesite(app),
+        )
+
+def init_app(app):
+    backend = os.environ.get("SESSION_BACKEND", "sqlite")
+    if backend == "memory":
+        store = MemoryStore(max_entries=int(os.environ.get("SESSION_MAX_ENTRIES", "10000")))
+    elif backend == "sqlite":
+        store = SQLiteStore()
+    else:
+        raise ValueError(f"Unknown session backend: {backend}")
+    app.session_interface = ServerSessionInterface(store)
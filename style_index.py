@@ -0,0 +1,158 @@
+from collections import OrderedDict
+from db import db
+from models import StyleExemplar
+import numpy as np
+import threading
+import agent
+import os
+import logging
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Past emails included as few-shot examples in reply prompts
+EXEMPLAR_COUNT = int(os.environ.get("STYLE_EXEMPLARS", "2"))
+# Users whose index is kept in memory
+MAX_CACHED_INDEXES = 256
+# Exemplars kept per user. Each analysis adds a sample of its new messages,
+# so random older ones are dropped to keep the table and index bounded.
+MAX_STORED_EXEMPLARS = 2000
+
+class StyleIndex:
+    """
+    Nearest-neighbour search over the style vectors of a user's sent mail.
+
+    Distances are Euclidean over z-normalized features, each scaled by the
+    square root of its StyleAnalyzer weight. The normalized matrix and its
+    row norms are computed once, so a query is one matrix-vector product
+    and an argpartition.
+
+    Args:
+        ids (list): Gmail message IDs, one per row.
+        bodies (list): Message bodies, one per row.
+        vectors (np.ndarray): Style vectors of shape (len(ids), len(weights)).
+        weights (np.ndarray): Weight of each feature.
+    """
+    def __init__(self, ids, bodies, vectors, weights):
+        self.ids = ids
+        self.bodies = bodies
+        vectors = np.asarray(vectors, dtype=np.float32)
+        self.mean = vectors.mean(axis=0)
+        std = vectors.std(axis=0)
+        # Features that never vary for this user carry no style information
+        varying = std > 1e-6
+        self.scale = np.where(varying, np.sqrt(weights) / np.where(varying, std, 1), 0).astype(np.float32)
+        self.total_weight = float(np.sum(weights[varying])) or 1.0
+        self.matrix = (vectors - self.mean) * self.scale
+        self.norms = np.einsum('ij,ij->i', self.matrix, self.matrix)
+        # Drift of the user's own median message, for comparison with drift()
+        self.typical_drift = float(np.median(np.sqrt(self.norms / self.total_weight)))
+
+    def __len__(self):
+        return len(self.ids)
+
+    def project(self, vector):
+        return (np.asarray(vector, dtype=np.float32) - self.mean) * self.scale
+
+    def nearest(self, vector, k=EXEMPLAR_COUNT):
+        """
+        Finds the stored messages stylistically closest to a vector.
+
+        Returns:
+            list: (message ID, body, distance) tuples, closest first.
+        """
+        k = min(k, len(self.ids))
+        if k <= 0:
+            return []
+        query = self.project(vector)
+        distances = np.maximum(self.norms - 2 * (self.matrix @ query) + query @ query, 0)
+        top = np.argpartition(distances, k - 1)[:k]
+        top = top[np.argsort(distances[top])]
+        return [(self.ids[i], self.bodies[i], float(np.sqrt(distances[i]))) for i in top]
+
+    def drift(self, vector):
+        """
+        Returns how far a vector is from the user's average style, as a
+        weighted root mean square of its feature z-scores. Compare it with
+        typical_drift, the same score for the user's median message.
+        """
+        query = self.project(vector)
+        return float(np.sqrt(query @ query / self.total_weight))
+
+_indexes = OrderedDict()
+_indexes_lock = threading.Lock()
+
+def store_exemplars(user_id, exemplars):
+    """
+    Saves per-message style vectors produced by agent.update_style_profile,
+    keeping at most MAX_STORED_EXEMPLARS per user.
+    """
+    for exemplar in exemplars:
+        db.session.merge(StyleExemplar(
+            user_id=user_id,
+            message_id=exemplar['id'],
+            body=exemplar['body'],
+            vector=agent.pack_style_vector(exemplar['vector']),
+        ))
+    db.session.flush()
+    count = db.session.execute(db.select(db.func.count(StyleExemplar.message_id)).where(StyleExemplar.user_id == user_id)).scalar()
+    if count > MAX_STORED_EXEMPLARS:
+        dropped = db.select(StyleExemplar.message_id).where(StyleExemplar.user_id == user_id).order_by(db.func.random()).limit(count - MAX_STORED_EXEMPLARS)
+        db.session.execute(db.delete(StyleExemplar).where(StyleExemplar.user_id == user_id, StyleExemplar.message_id.in_(dropped)))
+    db.session.commit()
+    # Once the cap is reached the count no longer changes, so get_index cannot notice
+    with _indexes_lock:
+        _indexes.pop(user_id, None)
+    logger.info(f"Stored {len(exemplars)} style exemplars for user {user_id}")
+
+def get_index(user_id):
+    """
+    Returns the user's StyleIndex, or None if they have no exemplars. Built
+    indexes are cached and rebuilt when the number of stored exemplars changes
+    or store_exemplars runs in this process.
+    """
+    count = db.session.execute(db.select(db.func.count(StyleExemplar.message_id)).where(StyleExemplar.user_id == user_id)).scalar()
+    if not count:
+        return None
+    with _indexes_lock:
+        index = _indexes.get(user_id)
+        if index is not None and len(index) == count:
+            _indexes.move_to_end(user_id)
+            return index
+
+    rows = db.session.execute(
+        db.select(StyleExemplar.message_id, StyleExemplar.body, StyleExemplar.vector).where(StyleExemplar.user_id == user_id)
+    ).all()
+    vectors = np.frombuffer(b"".join(row.vector for row in rows), dtype='<f4').reshape(len(rows), -1)
+    index = StyleIndex([row.message_id for row in rows], [row.body for row in rows], vectors, agent.analyzer.weights)
+    with _indexes_lock:
+        _indexes[user_id] = index
+        _indexes.move_to_end(user_id)
+        while len(_indexes) > MAX_CACHED_INDEXES:
+            _indexes.popitem(last=False)
+    return index
+
+def exemplars_for(user, k=EXEMPLAR_COUNT):
+    """
+    Returns the bodies of the user's past emails closest to their overall
+    style, for use as few-shot examples.
+    """
+    if user.styleVector is None:
+        return []
+    index = get_index(user.id)
+    if index is None:
+        return []
+    return [body for _, body, _ in index.nearest(agent.unpack_style_vector(user.styleVector), k)]
+
+def score_drift(user_id, vector):
+    """
+    Scores how far a generated reply's style vector is from the user's sent mail.
+
+    Returns:
+        dict: {"drift": score of the reply, "typical": score of the user's
+              median message}, or None if the user has no exemplars.
+    """
+    index = get_index(user_id)
+    if index is None:
+        return None
+    return {"drift": index.drift(vector), "typical": index.typical_drift}
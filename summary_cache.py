@@ -0,0 +1,92 @@
+from db import db
+from models import SummaryCache
+from datetime import datetime
+import hashlib
+import threading
+import agent
+import logging
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+MAX_ENTRIES = 1000
+MAX_BYTES = 20 * 1024 * 1024
+
+_lock = threading.Lock()
+hits = 0
+misses = 0
+
+def cache_key(thread_text):
+    """
+    Content address of a summary: the thread text plus everything that can
+    change the model's output for it.
+    """
+    digest = hashlib.sha256()
+    digest.update(f"{agent.MODEL_NAME}\0{agent.SUMMARY_PROMPT_VERSION}\0".encode('utf-8'))
+    digest.update(thread_text.encode('utf-8'))
+    return digest.hexdigest()
+
+def contains(thread_text):
+    """
+    Returns True if a summary of the thread is cached, without counting a lookup.
+    """
+    return db.session.get(SummaryCache, cache_key(thread_text)) is not None
+
+def lookup(thread_text):
+    """
+    Returns the cached summary of a thread, or None if it has not been
+    summarized before.
+    """
+    global hits, misses
+    entry = db.session.get(SummaryCache, cache_key(thread_text))
+    if entry is None:
+        with _lock:
+            misses += 1
+        return None
+    with _lock:
+        hits += 1
+    entry.last_used = datetime.utcnow()
+    db.session.commit()
+    logger.info("Summary cache hit")
+    return entry.summary
+
+def store(thread_text, summary):
+    """
+    Stores the summary of a thread and evicts old entries if needed.
+    """
+    now = datetime.utcnow()
+    db.session.merge(SummaryCache(key=cache_key(thread_text), summary=summary, size=len(summary.encode('utf-8')), created_at=now, last_used=now))
+    db.session.commit()
+    evict()
+
+def evict():
+    """
+    Removes the least recently used summaries until the cache fits in
+    MAX_ENTRIES and MAX_BYTES.
+    """
+    count, total = db.session.execute(db.select(db.func.count(SummaryCache.key), db.func.coalesce(db.func.sum(SummaryCache.size), 0))).one()
+    if count <= MAX_ENTRIES and total <= MAX_BYTES:
+        return
+    entries = db.session.execute(db.select(SummaryCache.key, SummaryCache.size).order_by(SummaryCache.last_used)).all()
+    stale = []
+    for key, size in entries:
+        if count <= MAX_ENTRIES and total <= MAX_BYTES:
+            break
+        stale.append(key)
+        count -= 1
+        total -= size
+    db.session.execute(db.delete(SummaryCache).where(SummaryCache.key.in_(stale)))
+    db.session.commit()
+    logger.info(f"Evicted {len(stale)} cached summaries")
+
+def stats():
+    count, total = db.session.execute(db.select(db.func.count(SummaryCache.key), db.func.coalesce(db.func.sum(SummaryCache.size), 0))).one()
+    with _lock:
+        lookups = hits + misses
+        return {
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': hits / lookups if lookups else 0.0,
+            'entries': count,
+            'bytes_stored': total,
+        }
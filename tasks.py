@@ -0,0 +1,166 @@
+from google.oauth2.credentials import Credentials
+from concurrent.futures import ThreadPoolExecutor
+import get_messages
+from mail_text import compact_thread
+from llm_gateway import estimate_tokens
+import agent
+import json
+import re
+import logging
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Background job functions. They run on the job pool, possibly in another
+# process, so they only take plain data and never use the database or session.
+
+def convert_summary_to_html(summary_text):
+    lines = summary_text.strip().split('\n')
+    list_items = [re.sub(r'^\*\s*', '', line) for line in lines if line.strip().startswith("*")]
+    html = "<ul>\n" + "\n".join([f"<li>{item}</li>" for item in list_items]) + "\n</ul>"
+    return html
+
+def get_mail_thread(mails):
+    """
+    Builds the thread text sent to the model. Quoted history, signatures and
+    disclaimers repeated across messages are removed first, since each reply
+    usually embeds the whole conversation before it.
+    """
+    bodies = compact_thread([mail['body'] for mail in mails])
+    thread = "".join(
+        f"From: {mail['SenderName']} \nSubject: {mail['subject']}\n{body}\n\n"
+        for mail, body in zip(mails, bodies)
+    )
+    raw_tokens = estimate_tokens([{"content": mail['body']} for mail in mails])
+    compact_tokens = estimate_tokens([{"content": body} for body in bodies])
+    logger.info(f"Thread compaction saved ~{raw_tokens - compact_tokens} of ~{raw_tokens} body tokens across {len(mails)} messages")
+    return thread
+
+def analyze_style(credentials_json, profile, limit=None, backfill_exemplars=False):
+    """
+    Streams the user's sent mail and folds new messages into their style profile.
+    With backfill_exemplars, messages already in the profile are fetched
+    and parsed too, to collect the exemplars missing for them.
+
+    Returns:
+        dict: {"profile": updated profile, "style_vector": feature values in
+              StyleAnalyzer.feature_names order, "style_summary": short summary
+              for prompts, "exemplars": new messages with their own style
+              vectors}. The vector and summary are None without messages.
+    """
+    credentials = Credentials.from_authorized_user_info(json.loads(credentials_json))
+    seen = set(profile['message_ids']) if profile and not backfill_exemplars else set()
+    messages = get_messages.iter_messages(credentials, label_ids=["SENT"], limit=limit, skip_ids=seen, background=True)
+    profile, features, exemplars = agent.update_style_profile(profile, messages, include_seen=backfill_exemplars)
+    if features is None:
+        return {"profile": profile, "style_vector": None, "style_summary": None, "exemplars": exemplars}
+    style_summary = agent.analyzer.summarize_style(features)
+    logger.info(f"Writing Style : {style_summary}")
+    return {
+        "profile": profile,
+        "style_vector": agent.analyzer.to_vector(features).tolist(),
+        "style_summary": style_summary,
+        "exemplars": exemplars,
+    }
+
+def prepare_reply(thread_text, cached_summary, style_hint, name, exemplars=None):
+    """
+    Summarizes a thread (unless a cached summary is given) and asks the model
+    which information is missing before a reply can be written.
+
+    A reply is drafted speculatively while the missing-info check runs. In
+    the common case where no questions are needed the draft is returned
+    straight away, so the page costs about one LLM round trip after the
+    summary. If questions come back, the draft is discarded; the call is
+    already in flight by then and cannot be stopped, so it still finishes
+    and costs tokens. If drafting fails, no reply is returned and the page
+    streams one instead.
+
+    Returns:
+        dict: The raw and HTML summaries, either the model's questions or
+              "FINAL ANSWER", and the drafted reply when no questions were asked.
+    """
+    raw_summary = cached_summary or agent.summarize_threads(thread_text)
+    summary = convert_summary_to_html(raw_summary.split("**Summary:**")[1])
+    logger.info(f"Summary Generated : {summary}")
+
+    pool = ThreadPoolExecutor(max_workers=1)
+    draft = pool.submit(agent.generate_email_reply, summary, style_hint, "", exemplars)
+    # Don't wait for a draft that may be discarded
+    pool.shutdown(wait=False)
+
+    questions = agent.run_email_assistant(summary, style_hint, name, "")
+    logger.info(f"Received questions {questions}")
+    reply = None
+    if questions == "FINAL ANSWER":
+        try:
+            reply = re.sub(r"^\s*FINAL ANSWER:\s*", "", draft.result())
+        except Exception as error:
+            logger.warning(f"Speculative reply draft failed, falling back to streaming: {error}")
+    else:
+        logger.info("Discarding speculative reply draft")
+    return {"raw_summary": raw_summary, "summary": summary, "questions": questions, "reply": reply}
+
+def prefetch_thread(credentials_json, thread_id):
+    """
+    Fetches a thread and summarizes it ahead of the user opening it.
+
+    Returns:
+        dict: The thread's messages and the raw summary of their text.
+    """
+    credentials = Credentials.from_authorized_user_info(json.loads(credentials_json))
+    mails = sorted(get_messages.get_thread(credentials, thread_id) or [], key=lambda mail: mail['date'])
+    return {"mails": mails, "raw_summary": agent.summarize_threads(get_mail_thread(mails))}
+
+def sync_mailbox(credentials_json, history_id, max_results=100, service=None):
+    """
+    Fetches the mailbox changes since history_id. Without a history_id, or
+    when Gmail has expired it, falls back to fetching the most recent mail.
+
+    Args:
+        credentials_json (str): The user's credentials, unused if service is given.
+        history_id (str): historyId of the last sync, or None.
+        max_results (int): Messages fetched by a full resync.
+        service: Gmail service to use, e.g. one built on fake_gmail.FakeGmailHttp.
+                 By default the user's background service is leased.
+
+    Returns:
+        dict: Messages to index, IDs to remove, the new historyId, whether
+              this was a full resync and, for a full resync, whether it
+              fetched the whole mailbox.
+    """
+    credentials = Credentials.from_authorized_user_info(json.loads(credentials_json)) if service is None else None
+    with get_messages.use_service(credentials, service, background=True) as service:
+        if history_id:
+            try:
+                added, deleted, new_history_id = get_messages.get_history(credentials, history_id, service=service)
+                messages = get_messages.get_messages_by_id(credentials, added, service=service)
+                return {"messages": messages, "deleted": deleted, "history_id": new_history_id, "full": False}
+            except get_messages.HistoryExpired:
+                logger.warning("Mailbox history expired, running a full resync")
+
+        # Read the historyId first so changes made during the fetch are picked up next time
+        new_history_id = get_messages.get_history_id(credentials, service=service)
+        messages = get_messages.get_recent_messages(credentials, max_results, service=service)
+    return {"messages": messages, "deleted": [], "history_id": new_history_id, "full": True, "complete": len(messages) < max_results}
+
+def backfill_mailbox(credentials_json, before, skip_ids, batch_size=100):
+    """
+    Fetches the next batch of mail older than what the index already holds,
+    so the index grows from the most recent mail to the whole mailbox.
+    Batches are small and use the background Gmail service, so the chain of
+    backfill jobs never holds up interactive requests for long.
+
+    Args:
+        before (int): Unix time of the oldest indexed message, in seconds.
+        skip_ids (list): Already indexed message IDs from that same second.
+
+    Returns:
+        dict: Messages to index and whether the mailbox is now fully covered.
+    """
+    credentials = Credentials.from_authorized_user_info(json.loads(credentials_json))
+    # before: is exclusive, so the oldest second is included and its known messages skipped
+    messages = list(get_messages.iter_messages(
+        credentials, query=f"before:{before + 1}", page_size=batch_size, limit=batch_size, skip_ids=set(skip_ids), background=True
+    ))
+    return {"messages": messages, "complete": len(messages) < batch_size}